@@ -1,5 +1,6 @@
 import streamlit as st
 import os
+import io
 import pandas as pd
 from src.pipeline.predict_pipeline import ChurnInference
 from src.utils import load_json
@@ -8,13 +9,31 @@ from dataclasses import dataclass
 @dataclass
 class AppConfigs:
     column_values_path:str = os.path.join("data","encoded","column_unique_values.json")
+
+
+# streamlit reruns this script on every widget change, so the heavy objects
+# are loaded once per process and the uploaded file is parsed once per content.
+# no spinners, as set_page_config has to stay the first streamlit command
+@st.cache_resource(show_spinner=False)
+def load_churn_model():
+    return ChurnInference()
+
+
+@st.cache_resource(show_spinner=False)
+def load_input_sections(column_values_path):
+    return load_json(column_values_path)
+
+
+@st.cache_data(show_spinner=False)
+def parse_batch_file(file_content):
+    return pd.read_csv(io.BytesIO(file_content))
     
     
 class ChurnApp:
     def __init__(self):
         self.app_configs = AppConfigs()
-        self.input_sections = load_json(self.app_configs.column_values_path)
-        self.model = ChurnInference()
+        self.input_sections = load_input_sections(self.app_configs.column_values_path)
+        self.model = load_churn_model()
         
     def display_prediction(self, prediction, probability):
         st.write("## Prediction:")
@@ -68,10 +87,11 @@ class ChurnApp:
         batch_file = st.sidebar.file_uploader("Upload a CSV file", type=["csv"])
         print(batch_file)
         if batch_file is not None:
-            batch_input_df = pd.read_csv(batch_file)
+            batch_input_df = parse_batch_file(batch_file.getvalue())
             
             if st.button("Batch Predict"):
-                batch_predictions_df = self.model.predict_churn(batch_input_df)
+                # joined to a shallow copy, the parsed upload is neither modified nor duplicated
+                batch_predictions_df = self.model.predict_churn(batch_input_df, output_mode="join")
                 st.dataframe(batch_predictions_df)
             
 
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+
+class CompiledPreprocessor:
+    """
+    Flat, NumPy-only replacement for the fitted ColumnTransformer built in
+    DataTransformation.get_data_transformer_obj. It keeps only the fitted statistics
+    (imputation values, scaler means / scales and one-hot category lookups), so
+    `transform` skips sklearn's generic validation and column dispatch while giving
+    the same output as `preprocessor.transform`.
+    """
+    # below this many rows a python dict lookup per value beats pandas' hash-table setup
+    small_batch_rows = 256
+
+    def __init__(self, numeric_cols, numeric_fill_values, numeric_means, numeric_scales,
+                 categorical_cols, categorical_fill_values, categories, sparse_output=False):
+        self.numeric_cols = list(numeric_cols)
+        self.numeric_fill_values = np.asarray(numeric_fill_values, dtype=np.float64)
+        self.numeric_means = np.asarray(numeric_means, dtype=np.float64)
+        self.numeric_scales = np.asarray(numeric_scales, dtype=np.float64)
+
+        self.categorical_cols = list(categorical_cols)
+        self.categorical_fill_values = list(categorical_fill_values)
+        self.categories = [pd.Index(cats) for cats in categories]
+        self.category_lookups = [{value: i for i, value in enumerate(cats)} for cats in categories]
+        self.category_offsets = np.cumsum([len(self.numeric_cols)] + [len(cats) for cats in self.categories])
+        self.n_features_out = int(self.category_offsets[-1])
+        self.sparse_output = sparse_output
+
+
+    @classmethod
+    def from_column_transformer(cls, preprocessor):
+        """Compiles a fitted ColumnTransformer with one numeric and one categorical pipeline."""
+        from sklearn.pipeline import Pipeline
+        from sklearn.impute import SimpleImputer
+        from sklearn.preprocessing import StandardScaler, OneHotEncoder
+
+        numeric_block = None
+        categorical_block = None
+        for name, transformer, cols in preprocessor.transformers_:
+            if name == "remainder" and transformer == "drop":
+                continue
+            steps = [step for _, step in transformer.steps] if isinstance(transformer, Pipeline) else [transformer]
+            imputers = [step for step in steps if isinstance(step, SimpleImputer)]
+            fill_values = imputers[0].statistics_ if imputers else [np.nan] * len(cols)
+
+            if isinstance(steps[-1], OneHotEncoder):
+                if numeric_block is None or categorical_block is not None:
+                    raise ValueError("preprocessor must hold a numeric pipeline followed by a categorical pipeline")
+                encoder = steps[-1]
+                if encoder.drop_idx_ is not None or encoder.handle_unknown != "error":
+                    raise ValueError("only OneHotEncoder(drop=None, handle_unknown='error') can be compiled")
+                categorical_block = (list(cols), list(fill_values), encoder.categories_)
+
+            elif all(isinstance(step, (SimpleImputer, StandardScaler)) for step in steps):
+                if numeric_block is not None:
+                    raise ValueError("preprocessor must hold a numeric pipeline followed by a categorical pipeline")
+                scalers = [step for step in steps if isinstance(step, StandardScaler)]
+                means = np.zeros(len(cols))
+                scales = np.ones(len(cols))
+                if scalers:
+                    if scalers[0].mean_ is not None:
+                        means = scalers[0].mean_
+                    if scalers[0].scale_ is not None:
+                        scales = scalers[0].scale_
+                numeric_block = (list(cols), fill_values, means, scales)
+
+            else:
+                raise ValueError(f"transformer {name} of the preprocessor can not be compiled")
+
+        if numeric_block is None or categorical_block is None:
+            raise ValueError("preprocessor must hold a numeric pipeline followed by a categorical pipeline")
+
+        return cls(*numeric_block, *categorical_block, sparse_output=preprocessor.sparse_output_)
+
+
+    def transform(self, df):
+        n_rows = len(df)
+        n_num = len(self.numeric_cols)
+
+        # numeric block : impute, then standardize in place
+        numeric = np.empty((n_rows, n_num), dtype=np.float64)
+        for j, col in enumerate(self.numeric_cols):
+            numeric[:, j] = df[col].to_numpy(dtype=np.float64)
+        missing = np.isnan(numeric)
+        if missing.any():
+            numeric[missing] = np.broadcast_to(self.numeric_fill_values, numeric.shape)[missing]
+        numeric -= self.numeric_means
+        numeric /= self.numeric_scales
+
+        # categorical block : impute, then look up the one-hot column of every value
+        hot_cols = np.empty((n_rows, len(self.categorical_cols)), dtype=np.int64)
+        for j, col in enumerate(self.categorical_cols):
+            column = df[col]
+            if isinstance(column.dtype, pd.CategoricalDtype) and column.cat.categories.equals(self.categories[j]):
+                # columns typed by InputSchema share the encoder's categories, their codes are the one-hot columns
+                codes = column.cat.codes.to_numpy(dtype=np.int64)
+                if (codes < 0).any():
+                    codes[codes < 0] = self.category_lookups[j].get(self.categorical_fill_values[j], -1)
+                if (codes < 0).any():
+                    raise ValueError(f"Found missing values without a known fill value in column {j} during transform")
+                hot_cols[:, j] = codes + self.category_offsets[j]
+                continue
+
+            values = column.to_numpy(dtype=object)
+            missing = pd.isna(values)
+            if missing.any():
+                values = np.where(missing, self.categorical_fill_values[j], values)
+            if n_rows <= self.small_batch_rows:
+                lookup = self.category_lookups[j]
+                codes = np.array([lookup.get(value, -1) for value in values], dtype=np.int64)
+            else:
+                codes = self.categories[j].get_indexer(values)
+            if (codes < 0).any():
+                unknown = pd.unique(values[codes < 0])
+                raise ValueError(f"Found unknown categories {list(unknown)} in column {j} during transform")
+            hot_cols[:, j] = codes + self.category_offsets[j]
+
+        if self.sparse_output:
+            from scipy import sparse
+
+            one_hot = sparse.csr_matrix(
+                (np.ones(hot_cols.size), (hot_cols - n_num).ravel(), np.arange(0, hot_cols.size + 1, hot_cols.shape[1])),
+                shape=(n_rows, self.n_features_out - n_num)
+            )
+            return sparse.hstack([sparse.csr_matrix(numeric), one_hot], format="csr")
+
+        transformed = np.zeros((n_rows, self.n_features_out), dtype=np.float64)
+        transformed[:, :n_num] = numeric
+        transformed[np.arange(n_rows)[:, None], hot_cols] = 1.0
+        return transformed
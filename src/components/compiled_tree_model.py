@@ -0,0 +1,203 @@
+import json
+
+import numpy as np
+
+
+class CompiledTreeEnsemble:
+    """
+    Flat, NumPy-only replacement for a fitted RandomForestClassifier or binary XGBClassifier.
+    The nodes of all trees are concatenated into feature, threshold and child arrays, and
+    `apply` walks every (row, tree) pair down one level per iteration for the whole batch
+    at once, instead of dispatching to every estimator. Leaves point to themselves, so the
+    pairs that reached theirs early simply stay there. `predict_proba` reproduces the
+    arithmetic of the source model, so the probabilities are the same.
+    """
+    # tree levels walked between two removals of the (row, tree) pairs already at a leaf
+    compaction_interval = 3
+
+    def __init__(self, kind, features, thresholds, left_children, right_children, default_left,
+                 leaf_values, roots, max_depth, classes, base_margin=0.0, source_model_uuid=None):
+        if kind not in ("random_forest", "xgboost"):
+            raise ValueError(f"unknown tree ensemble kind {kind}")
+        self.kind = kind
+        self.features = np.asarray(features, dtype=np.intp)
+        self.thresholds = np.asarray(thresholds)
+        self.left_children = np.asarray(left_children, dtype=np.intp)
+        self.right_children = np.asarray(right_children, dtype=np.intp)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.leaf_values = np.asarray(leaf_values)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.max_depth = int(max_depth)
+        self.classes_ = np.asarray(classes)
+        self.base_margin = np.float32(base_margin)
+        # model_uuid of the best_model the ensemble was compiled from, checked when it is loaded
+        self.source_model_uuid = source_model_uuid
+
+        # traversal arrays : the two children of node i at 2 * i and 2 * i + 1
+        self.children = np.stack([self.left_children, self.right_children], axis=1).ravel()
+        self.is_leaf = self.left_children == np.arange(self.left_children.size)
+        if kind == "random_forest":
+            # x <= t on a float32 x is x <= (largest float32 not above t), halves the threshold reads
+            thresholds = self.thresholds.astype(np.float32)
+            above = thresholds.astype(np.float64) > self.thresholds
+            thresholds[above] = np.nextafter(thresholds[above], np.float32(-np.inf))
+            self.thresholds = thresholds
+
+
+    @classmethod
+    def from_model(cls, model, source_model_uuid=None):
+        from sklearn.ensemble import RandomForestClassifier
+        from xgboost import XGBClassifier
+
+        if isinstance(model, RandomForestClassifier):
+            return cls.from_random_forest(model, source_model_uuid)
+        if isinstance(model, XGBClassifier):
+            return cls.from_xgboost(model, source_model_uuid)
+        raise ValueError(f"{model.__class__.__name__} can not be compiled, only RandomForestClassifier and XGBClassifier")
+
+
+    @classmethod
+    def from_random_forest(cls, forest, source_model_uuid=None):
+        if forest.n_outputs_ != 1:
+            raise ValueError("only single output forests can be compiled")
+
+        features, thresholds, lefts, rights, leaf_values, roots = [], [], [], [], [], []
+        n_nodes = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            is_leaf = tree.children_left == -1
+            node_ids = np.arange(tree.node_count) + n_nodes
+            roots.append(n_nodes)
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left + n_nodes))
+            rights.append(np.where(is_leaf, node_ids, tree.children_right + n_nodes))
+
+            # the class fractions DecisionTreeClassifier.predict_proba returns for every node
+            proba = tree.value[:, 0, :forest.n_classes_].astype(np.float64)
+            normalizer = proba.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            proba /= normalizer
+            leaf_values.append(proba)
+            n_nodes += tree.node_count
+
+        return cls(kind="random_forest",
+                   features=np.concatenate(features),
+                   thresholds=np.concatenate(thresholds).astype(np.float64),
+                   left_children=np.concatenate(lefts),
+                   right_children=np.concatenate(rights),
+                   default_left=np.zeros(n_nodes, dtype=bool),
+                   leaf_values=np.concatenate(leaf_values),
+                   roots=roots,
+                   max_depth=max(estimator.tree_.max_depth for estimator in forest.estimators_),
+                   classes=forest.classes_,
+                   source_model_uuid=source_model_uuid)
+
+
+    @classmethod
+    def from_xgboost(cls, model, source_model_uuid=None):
+        booster_json = json.loads(model.get_booster().save_raw("json"))
+        learner = booster_json["learner"]
+        if learner["objective"]["name"] != "binary:logistic" or learner["gradient_booster"]["name"] != "gbtree":
+            raise ValueError("only binary:logistic gbtree boosters can be compiled")
+
+        features, thresholds, lefts, rights, default_lefts, leaf_values, roots = [], [], [], [], [], [], []
+        max_depth = 0
+        n_nodes = 0
+        for tree in learner["gradient_booster"]["model"]["trees"]:
+            if any(split_type != 0 for split_type in tree["split_type"]):
+                raise ValueError("boosters with categorical splits can not be compiled")
+            left = np.asarray(tree["left_children"])
+            right = np.asarray(tree["right_children"])
+            # split_conditions holds the thresholds on the splits and the leaf values on the leaves
+            conditions = np.asarray(tree["split_conditions"], dtype=np.float32)
+            is_leaf = left == -1
+            node_ids = np.arange(len(left)) + n_nodes
+            roots.append(n_nodes)
+            features.append(np.where(is_leaf, 0, tree["split_indices"]))
+            thresholds.append(np.where(is_leaf, np.float32(np.inf), conditions))
+            lefts.append(np.where(is_leaf, node_ids, left + n_nodes))
+            rights.append(np.where(is_leaf, node_ids, right + n_nodes))
+            default_lefts.append(np.asarray(tree["default_left"], dtype=bool) | is_leaf)
+            leaf_values.append(np.where(is_leaf, conditions, np.float32(0.0)))
+
+            pending = [(0, 0)]
+            while pending:
+                node, depth = pending.pop()
+                max_depth = max(max_depth, depth)
+                if not is_leaf[node]:
+                    pending += [(left[node], depth + 1), (right[node], depth + 1)]
+            n_nodes += len(left)
+
+        # base_score is stored as a probability, the trees add to its logit
+        base_score = np.float32(learner["learner_model_param"]["base_score"])
+        base_margin = -np.log(np.float32(1.0) / base_score - np.float32(1.0))
+
+        return cls(kind="xgboost",
+                   features=np.concatenate(features),
+                   thresholds=np.concatenate(thresholds).astype(np.float32),
+                   left_children=np.concatenate(lefts),
+                   right_children=np.concatenate(rights),
+                   default_left=np.concatenate(default_lefts),
+                   leaf_values=np.concatenate(leaf_values).astype(np.float32)[:, np.newaxis],
+                   roots=roots,
+                   max_depth=max_depth,
+                   classes=model.classes_,
+                   base_margin=base_margin,
+                   source_model_uuid=source_model_uuid)
+
+
+    def apply(self, X):
+        """Index of the leaf reached by every row in every tree, shape (n_rows, n_trees)."""
+        # both models compare float32 feature values
+        X = np.asarray(X.toarray() if hasattr(X, "toarray") else X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+
+        # (tree, row) pairs in tree-major order, so that consecutive pairs read the nodes of the same tree
+        nodes = np.repeat(self.roots, n_rows)
+        pairs = np.arange(nodes.size)
+        current = nodes
+        row_offsets = np.tile(np.arange(n_rows) * n_features, self.roots.size)
+        for depth in range(1, self.max_depth + 1):
+            values = flat_X[row_offsets + self.features[current]]
+            if self.kind == "random_forest":
+                go_right = values > self.thresholds[current]
+            else:
+                go_right = ~(values < self.thresholds[current])
+                missing = np.isnan(values)
+                if missing.any():
+                    go_right[missing] = ~self.default_left[current[missing]]
+            current = self.children[2 * current + go_right]
+
+            # the pairs that reached their leaf are dropped every few levels, as that costs a pass of its own
+            if depth % self.compaction_interval == 0 or depth == self.max_depth:
+                nodes[pairs] = current
+                not_leaf = ~self.is_leaf[current]
+                pairs, current, row_offsets = pairs[not_leaf], current[not_leaf], row_offsets[not_leaf]
+                if not pairs.size:
+                    break
+        return nodes.reshape(self.roots.size, n_rows).T
+
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+        if self.kind == "random_forest":
+            # summed tree by tree, in the order RandomForestClassifier accumulates them
+            proba = np.zeros((leaves.shape[0], self.leaf_values.shape[1]), dtype=np.float64)
+            for tree in range(leaves.shape[1]):
+                proba += self.leaf_values[leaves[:, tree]]
+            proba /= leaves.shape[1]
+            return proba
+
+        margin = np.full(leaves.shape[0], self.base_margin, dtype=np.float32)
+        for tree in range(leaves.shape[1]):
+            margin += self.leaf_values[leaves[:, tree], 0]
+        # xgboost's sigmoid uses the C library expf, which float64 exp rounded to float32 matches ;
+        # numpy's own float32 exp can be one ulp away
+        positive = np.float32(1.0) / (np.float32(1.0) + np.exp(-margin.astype(np.float64)).astype(np.float32))
+        return np.vstack((np.float32(1.0) - positive, positive)).transpose()
+
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
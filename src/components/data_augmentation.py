@@ -1,99 +1,279 @@
 import os
 import sys
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import numpy as np
+from scipy import sparse
 
-from imblearn.over_sampling import SMOTE, RandomOverSampler
+from imblearn.over_sampling import SMOTE, ADASYN, RandomOverSampler
 from imblearn.under_sampling import RandomUnderSampler
+from imblearn.utils import check_sampling_strategy
+from sklearn.neighbors import NearestNeighbors
 
 from src.logger import logging
 from src.exception import CustomException
+from src.utils import save_array, load_array, get_array_path, LazyArray, resolve_array
+from src.instrumentation import StageTimer
 
 
 
+# name -> (resample(X, y, random_state=None) -> (X_resampled, y_resampled), file suffix of its saved arrays)
+RESAMPLING_STRATEGIES = {}
+
+
+def register_resampling_strategy(name, file_suffix=None):
+    """Decorator registering a resampling function so that it can be listed in DataAugmentationConfig.strategies."""
+    def register(resample):
+        RESAMPLING_STRATEGIES[name] = (resample, file_suffix or name)
+        return resample
+    return register
+
+
+@register_resampling_strategy("undersampled")
+def random_undersampling(X, y, sampling_strategy=1.0, random_state=None):
+    rus = RandomUnderSampler(sampling_strategy=sampling_strategy, random_state=random_state)
+    return rus.fit_resample(X, y)
+
+
+@register_resampling_strategy("oversampled")
+def random_oversampling(X, y, sampling_strategy=1.0, random_state=None):
+    ros = RandomOverSampler(sampling_strategy=sampling_strategy, random_state=random_state)
+    return ros.fit_resample(X, y)
+
+
+@register_resampling_strategy("smoted", file_suffix="smote")
+def smote_oversampling(X, y, sampling_strategy=1.0, random_state=None):
+    smote = SMOTE(sampling_strategy=sampling_strategy, random_state=random_state)
+    return smote.fit_resample(X, y)
+
+
+@register_resampling_strategy("smoted_fast", file_suffix="smote_fast")
+def fast_smote_oversampling(X, y, sampling_strategy=1.0, random_state=None, k_neighbors=5, n_jobs=-1,
+                            index_sample_size=None, max_synthetic=None):
+    """
+    SMOTE for large training sets. Same interpolation as imblearn's SMOTE, but :
+      - the k-NN search runs on `n_jobs` cores and only for the seed rows actually drawn,
+      - with `index_sample_size`, neighbours are searched among a random subset of at most
+        that many minority rows (approximate neighbours, much smaller index),
+      - `max_synthetic` caps the total number of generated rows, split across the classes
+        in proportion to their deficit.
+    Like imblearn, every over-sampled class needs at least 2 rows to interpolate between.
+    """
+    if k_neighbors < 1:
+        raise ValueError(f"k_neighbors must be at least 1, got {k_neighbors}")
+    if index_sample_size is not None and index_sample_size < 2:
+        raise ValueError(f"index_sample_size must be at least 2 so that every seed keeps a neighbour, got {index_sample_size}")
+
+    random_state = np.random.RandomState(random_state)
+    n_samples_per_class = check_sampling_strategy(sampling_strategy, y, "over-sampling")
+    n_synthetic_total = sum(n_samples_per_class.values())
+    if max_synthetic is not None and n_synthetic_total > max_synthetic:
+        n_samples_per_class = {class_label: int(n_samples * max_synthetic / n_synthetic_total)
+                               for class_label, n_samples in n_samples_per_class.items()}
+
+    X_resampled, y_resampled = [X], [y]
+    for class_label, n_samples in n_samples_per_class.items():
+        if n_samples == 0:
+            continue
+        class_rows = np.flatnonzero(y == class_label)
+        X_class = X[class_rows]
+        n_class = len(class_rows)
+        if n_class < 2:
+            raise ValueError(f"class {class_label} has only {n_class} row, SMOTE needs at least 2 rows of a class to over-sample it")
+
+        index_rows = np.arange(n_class)
+        if index_sample_size is not None and index_sample_size < n_class:
+            index_rows = np.sort(random_state.choice(n_class, size=index_sample_size, replace=False))
+        n_neighbors = min(k_neighbors + 1, len(index_rows))
+        nn = NearestNeighbors(n_neighbors=n_neighbors, n_jobs=n_jobs).fit(X_class[index_rows])
+
+        # the same draws as imblearn : a uniform seed row, one of its k neighbours and a gap in [0, 1)
+        seeds = random_state.randint(low=0, high=n_class, size=n_samples)
+        unique_seeds, seed_pos = np.unique(seeds, return_inverse=True)
+        neighbours = index_rows[nn.kneighbors(X_class[unique_seeds], return_distance=False)]
+        # drop the seed itself when it is part of the index, otherwise the farthest neighbour ;
+        # with at least 2 index rows every seed keeps one neighbour or more
+        is_self = neighbours == unique_seeds[:, None]
+        order = np.argsort(is_self, axis=1, kind="stable")
+        neighbours = np.take_along_axis(neighbours, order, axis=1)[:, :n_neighbors - 1]
+
+        picked = neighbours[seed_pos, random_state.randint(low=0, high=neighbours.shape[1], size=n_samples)]
+        gaps = random_state.uniform(size=n_samples)
+        if sparse.issparse(X):
+            X_new = X_class[seeds] + sparse.diags(gaps) @ (X_class[picked] - X_class[seeds])
+        else:
+            X_new = X_class[seeds] + gaps[:, None] * (X_class[picked] - X_class[seeds])
+        X_resampled.append(X_new.astype(X.dtype))
+        y_resampled.append(np.full(n_samples, class_label, dtype=y.dtype))
+
+    if sparse.issparse(X):
+        return sparse.vstack(X_resampled, format=X.format), np.hstack(y_resampled)
+    return np.vstack(X_resampled), np.hstack(y_resampled)
+
+
+def compare_resampling(X, y, strategy="smoted_fast", reference_strategy="smoted", random_state=0):
+    """
+    Resamples (X, y) with `strategy` and `reference_strategy` and compares their outputs :
+    the class counts, and per feature a two-sample Kolmogorov-Smirnov test between the
+    synthetic rows of both. Returns (class counts per strategy, DataFrame of KS statistics
+    and p-values per feature).
+    """
+    import pandas as pd
+    from scipy.stats import ks_2samp
+
+    resampled = {name: RESAMPLING_STRATEGIES[name][0](X, y, random_state=random_state) for name in (strategy, reference_strategy)}
+    class_counts = {name: dict(zip(*np.unique(y_res, return_counts=True))) for name, (_, y_res) in resampled.items()}
+
+    synthetic = {}
+    for name, (X_res, _) in resampled.items():
+        X_new = X_res[X.shape[0]:]
+        synthetic[name] = X_new.toarray() if sparse.issparse(X_new) else np.asarray(X_new)
+    ks_tests = [ks_2samp(synthetic[strategy][:, j], synthetic[reference_strategy][:, j]) for j in range(X.shape[1])]
+    ks_results = pd.DataFrame({"feature": np.arange(X.shape[1]),
+                               "ks_statistic": [test.statistic for test in ks_tests],
+                               "p_value": [test.pvalue for test in ks_tests]})
+    return class_counts, ks_results
+
+
+@register_resampling_strategy("adasyn")
+def adasyn_oversampling(X, y, sampling_strategy=1.0, random_state=None):
+    adasyn = ADASYN(sampling_strategy=sampling_strategy, random_state=random_state)
+    return adasyn.fit_resample(X, y)
+
+
 @dataclass
 class DataAugmentationConfig:
-    undersampled_train_x_data_enc_path: str = os.path.join("data","augmented", "train_x_oh_encoded_undersampled.npy")
-    undersampled_train_y_data_enc_path: str = os.path.join("data","augmented", "train_y_encoded_undersampled.npy")
+    augmented_data_dir: str = os.path.join("data","augmented")
+    # datasets handed to the trainer, in this order ; "original" is the encoded training data itself,
+    # every other name must be registered in RESAMPLING_STRATEGIES
+    strategies: tuple = ("original", "undersampled", "oversampled", "smoted")
+    # extra keyword arguments per strategy, e.g. {"smoted_fast": {"index_sample_size": 50_000, "max_synthetic": 1_000_000}}
+    strategy_params: dict = field(default_factory=dict)
 
-    oversampled_train_x_data_enc_path: str = os.path.join("data","augmented", "train_x_oh_encoded_oversampled.npy")
-    oversampled_train_y_data_enc_path: str = os.path.join("data","augmented", "train_y_encoded_oversampled.npy")
 
-    smote_train_x_data_enc_path: str = os.path.join("data","augmented", "train_x_oh_encoded_smote.npy")
-    smote_train_y_data_enc_path: str = os.path.join("data","augmented", "train_y_encoded_smote.npy")
 
+class DataAugmentation:
+    def __init__(self, data_augmentation_configs=None):
+        self.data_augmentation_configs = data_augmentation_configs or DataAugmentationConfig()
+        # one finished StageTimer per strategy produced by iter_augmented_data
+        self.stage_timers = []
 
+    def get_strategy_paths(self, strategy, is_sparse=False):
+        """Augmented feature matrices are written as .npz when the encoded training data is sparse."""
+        file_suffix = RESAMPLING_STRATEGIES[strategy][1]
+        augmented_data_dir = self.data_augmentation_configs.augmented_data_dir
+        return (
+            get_array_path(os.path.join(augmented_data_dir, f"train_x_oh_encoded_{file_suffix}.npy"), is_sparse),
+            os.path.join(augmented_data_dir, f"train_y_encoded_{file_suffix}.npy")
+        )
 
-class DataAugmentation:
-    def __init__(self):
-        self.data_augmentation_configs = DataAugmentationConfig()
+    def get_artifact_paths(self, is_sparse=False):
+        return [path for strategy in self.data_augmentation_configs.strategies if strategy != "original"
+                for path in self.get_strategy_paths(strategy, is_sparse)]
 
     def perform_undersampling(self, X,y, sampling_strategy=1.0, random_state=None):
-        rus = RandomUnderSampler(sampling_strategy=sampling_strategy, random_state=random_state)
-        X_resampled, y_resampled = rus.fit_resample(X, y)
-
-        return X_resampled, y_resampled
+        return random_undersampling(X, y, sampling_strategy=sampling_strategy, random_state=random_state)
 
 
     def perform_oversampling(self, X, y, sampling_strategy=1.0, random_state=None):
-        ros = RandomOverSampler(sampling_strategy=sampling_strategy, random_state=random_state)
-        X_resampled, y_resampled = ros.fit_resample(X, y)
-
-        return X_resampled, y_resampled
+        return random_oversampling(X, y, sampling_strategy=sampling_strategy, random_state=random_state)
 
 
     def perform_smote(self, X, y, sampling_strategy=1.0, random_state=None):
-        smote = SMOTE(sampling_strategy=sampling_strategy, random_state=random_state)
-        X_resampled, y_resampled = smote.fit_resample(X, y)
+        return smote_oversampling(X, y, sampling_strategy=sampling_strategy, random_state=random_state)
+
 
-        return X_resampled, y_resampled
+    def perform_fast_smote(self, X, y, sampling_strategy=1.0, random_state=None, **smote_params):
+        return fast_smote_oversampling(X, y, sampling_strategy=sampling_strategy, random_state=random_state, **smote_params)
     
 
-    def augment_data(self, train_x, train_y):
+    def resample(self, strategy, train_x, train_y):
+        logging.info(f"Starting {strategy} augmentation ...")
+        train_x, train_y = resolve_array(train_x), resolve_array(train_y)
+        logging.debug(f"{train_x.shape}-{train_y.shape}")
+
+        resample = RESAMPLING_STRATEGIES[strategy][0]
+        resampled_train_x, resampled_train_y = resample(train_x, train_y, **self.data_augmentation_configs.strategy_params.get(strategy, {}))
+
+        x_path, y_path = self.get_strategy_paths(strategy, is_sparse=sparse.issparse(resampled_train_x))
+        save_array(x_path, resampled_train_x)
+        save_array(y_path, resampled_train_y)
+        unique_values, counts = np.unique(resampled_train_y, return_counts=True)
+        value_counts_dict = dict(zip(unique_values, counts))
+        logging.info("\nAfter {} :\n {}".format(strategy, value_counts_dict))
 
+        return resampled_train_x, resampled_train_y
+
+
+    def iter_augmented_data(self, train_x, train_y, is_sparse=None, stage_cache=None, input_paths=(), lazy=False):
+        """
+        Yields (strategy, X, y) for every configured strategy, resampling each one only when
+        the consumer asks for it. `train_x` / `train_y` may be LazyArray handles.
+
+        With a `stage_cache`, a strategy whose inputs (`input_paths`), config and code are
+        unchanged is reloaded from its saved arrays instead - as LazyArray handles when `lazy`.
+        """
         try:
-            logging.info("Starting Augmentation ...")
-            os.makedirs(os.path.dirname(self.data_augmentation_configs.undersampled_train_x_data_enc_path), exist_ok=True)
-
-            # Undersampling
-            undersampled_train_x, undersampled_train_y = self.perform_undersampling(train_x, train_y)
-            np.save(self.data_augmentation_configs.undersampled_train_x_data_enc_path, undersampled_train_x)
-            np.save(self.data_augmentation_configs.undersampled_train_y_data_enc_path, undersampled_train_y)
-            logging.info("Undersampling done.")
-            unique_values, counts = np.unique(undersampled_train_y, return_counts=True)
-            value_counts_dict = dict(zip(unique_values, counts))
-            logging.info("\nAfter Undersampling :\n {}".format(value_counts_dict))
-
-            # Oversampling
-            oversampled_train_x, oversampled_train_y = self.perform_oversampling(train_x, train_y)
-            np.save(self.data_augmentation_configs.oversampled_train_x_data_enc_path, oversampled_train_x)
-            np.save(self.data_augmentation_configs.oversampled_train_y_data_enc_path, oversampled_train_y)
-            logging.info("Oversampling done.")
-            unique_values, counts = np.unique(oversampled_train_y, return_counts=True)
-            value_counts_dict = dict(zip(unique_values, counts))
-            logging.info("\nAfter Oversampling :\n {}".format(value_counts_dict))
-
-            # SMOTE
-            logging.debug(f"{train_x.shape}-{train_y.shape}")
-            smote_train_x, smote_train_y = self.perform_smote(train_x, train_y)
-            np.save(self.data_augmentation_configs.smote_train_x_data_enc_path, smote_train_x)
-            np.save(self.data_augmentation_configs.smote_train_y_data_enc_path, smote_train_y)
-            logging.info("SMOTE done.")
-            unique_values, counts = np.unique(smote_train_y, return_counts=True)
-            value_counts_dict = dict(zip(unique_values, counts))
-            logging.info("\nAfter SMOTE :\n {}".format(value_counts_dict))
-
-            return [
-                ("original", train_x, train_y),
-                ("undersampled", undersampled_train_x, undersampled_train_y),
-                ("oversampled", oversampled_train_x, oversampled_train_y),
-                ("smoted", smote_train_x, smote_train_y)
-            ]
-        
+            if is_sparse is None:
+                is_sparse = sparse.issparse(resolve_array(train_x))
+
+            for strategy in self.data_augmentation_configs.strategies:
+                if strategy == "original":
+                    yield strategy, train_x, train_y
+                    continue
+
+                if strategy not in RESAMPLING_STRATEGIES:
+                    raise ValueError(f"unknown resampling strategy {strategy}, registered : {list(RESAMPLING_STRATEGIES)}")
+
+                with StageTimer(f"data_augmentation_{strategy}") as timer:
+                    if stage_cache is None:
+                        resampled_train_x, resampled_train_y = self.resample(strategy, train_x, train_y)
+                    else:
+                        x_path, y_path = self.get_strategy_paths(strategy, is_sparse)
+                        load_saved = (lambda: (LazyArray(x_path), LazyArray(y_path))) if lazy else (lambda: (load_array(x_path), load_array(y_path)))
+                        resampled_train_x, resampled_train_y = stage_cache.run(
+                            f"data_augmentation_{strategy}",
+                            run_stage=lambda: self.resample(strategy, train_x, train_y),
+                            load_stage=load_saved,
+                            input_paths=input_paths,
+                            params={"strategy": strategy, "is_sparse": is_sparse,
+                                    "augmented_data_dir": self.data_augmentation_configs.augmented_data_dir,
+                                    "strategy_params": self.data_augmentation_configs.strategy_params.get(strategy, {})},
+                            code_objects=[DataAugmentation],
+                            output_paths=[x_path, y_path]
+                        )
+                    timer.rows = resolve_array(resampled_train_y).shape[0]
+                self.stage_timers.append(timer)
+
+                yield strategy, resampled_train_x, resampled_train_y
+
         except Exception as e:
             raise CustomException(e)
-        
 
-        
 
+    def augment_data(self, train_x, train_y):
+        """Eagerly produces every configured strategy, as a list of (strategy, X, y)."""
+        try:
+            augmented_data_list = list(self.iter_augmented_data(train_x, train_y))
+            logging.info("Augmentation done.")
+            return augmented_data_list
         
+        except Exception as e:
+            raise CustomException(e)
+
+
+if __name__ == "__main__":
+    # python src/components/data_augmentation.py [strategy] : checks that a strategy (smoted_fast by default)
+    # with its default settings produces the class counts and synthetic feature distributions of SMOTE
+    # on the encoded training data ; exits with an error when they differ
+    strategy = sys.argv[1] if len(sys.argv) > 1 else "smoted_fast"
+    train_x = load_array(get_array_path(os.path.join("data", "encoded", "train_x_oh_encoded.npy"), False))
+    train_y = load_array(os.path.join("data", "encoded", "train_y_encoded.npy"))
+
+    class_counts, ks_results = compare_resampling(train_x, train_y, strategy=strategy)
+    differing = ks_results[ks_results["p_value"] < 0.01]
+    print(f"class counts : {class_counts}")
+    print(f"smallest KS p-values :\n{ks_results.nsmallest(5, 'p_value').to_string(index=False)}")
+    counts = list(class_counts.values())
+    if counts[0] != counts[1] or len(differing):
+        sys.exit(f"{strategy} differs from smoted : {len(differing)} features with a KS p-value below 0.01")
+    print(f"{strategy} matches smoted on {len(ks_results)} features")
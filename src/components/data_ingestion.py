@@ -5,6 +5,7 @@ print("Current directory:\n", os.getcwd(),"\n\n")
 
 from src.exception import CustomException
 from src.logger import logging
+from src.utils import save_dataframe, is_categorical
 import pandas as pd
 import numpy as np
 import json
@@ -78,6 +79,8 @@ movie_tuple = movie1.__tuple__
 @dataclass
 class DataIngestionConfig:
     raw_data_path: str = os.path.join("data","raw", "WA_Fn-UseC_-Telco-Customer-Churn.csv")
+    # batches of new customers added by the incremental training, read after raw_data_path in name order
+    new_raw_data_dir: str = os.path.join("data","raw", "new")
     intermediate_raw_data_path: str = os.path.join("data","intermediate", "intermediate_data.csv")
 
     train_x_data_path: str = os.path.join("data","intermediate", "train_x.csv")
@@ -86,41 +89,97 @@ class DataIngestionConfig:
     test_x_data_path: str = os.path.join("data","intermediate", "test_x.csv")
     test_y_data_path: str = os.path.join("data","intermediate", "test_y.csv")
 
+    # "csv", or "parquet" / "feather" to keep the intermediate files columnar and typed
+    intermediate_format: str = "csv"
+    # 0/1 coded columns that stay numeric in the typed intermediate files, as the csv round trip reads them
+    numeric_coded_cols: tuple = ("SeniorCitizen",)
 
+    def __post_init__(self):
+        if self.intermediate_format not in ("csv", "parquet", "feather"):
+            raise ValueError(f"unsupported intermediate format {self.intermediate_format}")
+        for field_name in ["intermediate_raw_data_path", "train_x_data_path", "train_y_data_path",
+                           "test_x_data_path", "test_y_data_path"]:
+            path = getattr(self, field_name)
+            setattr(self, field_name, os.path.splitext(path)[0] + "." + self.intermediate_format)
 
-class DataIngestion:
-    def __init__(self):
-        self.data_configs = DataIngestionConfig()
 
-    def change_dtype(self, value, to_type=float):
-        try:
-            return to_type(value)
-        except:
-            None
+class DataIngestion:
+    def __init__(self, data_configs=None):
+        self.data_configs = data_configs or DataIngestionConfig()
+
+    def get_raw_data_paths(self):
+        new_raw_data_dir = self.data_configs.new_raw_data_dir
+        new_data_paths = []
+        if os.path.isdir(new_raw_data_dir):
+            new_data_paths = [os.path.join(new_raw_data_dir, file_name) for file_name in sorted(os.listdir(new_raw_data_dir))
+                              if file_name.endswith(".csv")]
+        return [self.data_configs.raw_data_path] + new_data_paths
+
+    def get_artifact_paths(self):
+        return [
+            self.data_configs.intermediate_raw_data_path,
+            self.data_configs.train_x_data_path,
+            self.data_configs.train_y_data_path,
+            self.data_configs.test_x_data_path,
+            self.data_configs.test_y_data_path
+        ]
+
+    def clean_raw_data(self, df):
+        """
+        Vectorized dtype fixing : TotalCharges to float (blank strings become NaN),
+        SeniorCitizen to a categorical string column, then drops the rows with missing
+        values. The number of dropped rows per reason is kept in `self.cleaning_report`.
+        """
+        total_charges = pd.to_numeric(df["TotalCharges"], errors="coerce")
+        not_numeric = total_charges.isna() & df["TotalCharges"].notna()
+        df["TotalCharges"] = total_charges
+        df["SeniorCitizen"] = df["SeniorCitizen"].astype(str).astype("category")
+
+        missing = df.isna().any(axis=1)
+        self.cleaning_report = {
+            "rows_in": len(df),
+            "dropped_TotalCharges_not_numeric": int(not_numeric.sum()),
+            "dropped_missing_values": int((missing & ~not_numeric).sum()),
+        }
+        df = df[~missing]
+        self.cleaning_report["rows_out"] = len(df)
+        logging.info(f"data cleaning report : {self.cleaning_report}")
+
+        return df
+
+    def set_intermediate_dtypes(self, df):
+        """Explicit dtypes for the columnar formats : categoricals for the string columns."""
+        for col in df.columns:
+            if col in self.data_configs.numeric_coded_cols:
+                df[col] = pd.to_numeric(df[col].astype(object)).astype(np.int64)
+            elif df[col].dtypes == object:
+                df[col] = df[col].astype("category")
+        return df
         
     def ingest_data(self):
         logging.info("Initiated data ingestion ...")
         try:
             # data loading 
-            df = pd.read_csv(self.data_configs.raw_data_path)
-            logging.info("Loaded the raw data ...")
+            raw_data_paths = self.get_raw_data_paths()
+            df = pd.concat([pd.read_csv(path) for path in raw_data_paths], ignore_index=True)
+            logging.info(f"Loaded the raw data from {len(raw_data_paths)} files ...")
             
 
             # dtype fixing and NA handling
-            df["TotalCharges"] = df["TotalCharges"].apply(lambda x: self.change_dtype(x, float))
-            df["SeniorCitizen"] = df["SeniorCitizen"].apply(lambda x: self.change_dtype(x, str))
-            df.dropna(inplace=True)
-
-            # saving intermediate data
-            os.makedirs(os.path.dirname(self.data_configs.intermediate_raw_data_path), exist_ok=True)
-            df.to_csv(self.data_configs.intermediate_raw_data_path, index=False)
-            logging.info(f"Data type fixing is done and saved at {self.data_configs.intermediate_raw_data_path}...")
+            df = self.clean_raw_data(df)
 
             # categorical, numeric features and target columns
-            self.categorical_cols = [col for col in df.columns if df[col].dtypes == object and col not in ["customerID", "Churn"]]
-            self.numeric_cols = [col for col in df.columns if df[col].dtypes != object and col not in ["customerID", "Churn"]]
+            self.categorical_cols = [col for col in df.columns if is_categorical(df[col]) and col not in ["customerID", "Churn"]]
+            self.numeric_cols = [col for col in df.columns if not is_categorical(df[col]) and col not in ["customerID", "Churn"]]
             self.target_col = ["Churn"]
 
+            if self.data_configs.intermediate_format != "csv":
+                df = self.set_intermediate_dtypes(df)
+
+            # saving intermediate data
+            save_dataframe(self.data_configs.intermediate_raw_data_path, df)
+            logging.info(f"Data type fixing is done and saved at {self.data_configs.intermediate_raw_data_path}...")
+
             # train test split
             X_df = df[self.categorical_cols+self.numeric_cols]
             y_df = df[self.target_col]
@@ -130,13 +189,12 @@ class DataIngestion:
                                                                                                 random_state=2)
 
             # saving train x,y dataframes
-            os.makedirs(os.path.dirname(self.data_configs.train_x_data_path), exist_ok=True)
-            self.train_X_df.to_csv(self.data_configs.train_x_data_path, index=False)
-            self.train_y_df.to_csv(self.data_configs.train_y_data_path, index=False)
+            save_dataframe(self.data_configs.train_x_data_path, self.train_X_df)
+            save_dataframe(self.data_configs.train_y_data_path, self.train_y_df)
 
             # saving test x,y dataframes
-            self.test_X_df.to_csv(self.data_configs.test_x_data_path, index=False)
-            self.test_y_df.to_csv(self.data_configs.test_y_data_path, index=False)
+            save_dataframe(self.data_configs.test_x_data_path, self.test_X_df)
+            save_dataframe(self.data_configs.test_y_data_path, self.test_y_df)
 
             
 
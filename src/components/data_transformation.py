@@ -10,7 +10,8 @@ from sklearn.impute import SimpleImputer
 
 from src.exception import CustomException
 from src.logger import logging
-from src.utils import save_object, save_json
+from src.utils import save_object, save_json, load_json, load_dataframe, save_array, load_array, get_array_path, is_categorical
+from src.components.compiled_preprocessor import CompiledPreprocessor
 
 import pandas as pd
 import json
@@ -28,16 +29,72 @@ class DataTransformationConfig:
     columns_values_enc = os.path.join("data","encoded", "column_unique_values.json")
 
     preprocessor_obj_path: str = os.path.join("artifacts", "preprocessor.pkl")
+    compiled_preprocessor_obj_path: str = os.path.join("artifacts", "compiled_preprocessor.pkl")
+
+    # keep the one-hot encoded matrices in scipy CSR format (saved as .npz) instead of dense arrays
+    sparse_output: bool = False
+
+    def __post_init__(self):
+        self.train_x_data_enc_path = get_array_path(self.train_x_data_enc_path, self.sparse_output)
+        self.test_x_data_enc_path = get_array_path(self.test_x_data_enc_path, self.sparse_output)
+
+
+def get_numeric_scaler(preprocessor):
+    """The numerical pipeline of a fitted preprocessor, as a list of steps, and its StandardScaler."""
+    numerical_pipeline = preprocessor.named_transformers_["numerical_pipeline"]
+    steps = [step for _, step in numerical_pipeline.steps] if isinstance(numerical_pipeline, Pipeline) else [numerical_pipeline]
+    scalers = [step for step in steps if isinstance(step, StandardScaler)]
+    if not scalers or not scalers[0].with_mean or not scalers[0].with_std:
+        raise ValueError("the numerical pipeline has no centering and scaling StandardScaler")
+    return steps, scalers[0]
+
+
+def get_scaler_params(preprocessor):
+    """MLflow params recording the standardization a model is fitted on (exact float reprs)."""
+    _, scaler = get_numeric_scaler(preprocessor)
+    return {"scaler_mean": json.dumps(scaler.mean_.tolist()), "scaler_scale": json.dumps(scaler.scale_.tolist())}
 
 
 class DataTransformation:
-    def __init__(self) -> None:
-         self.data_transform_configs = DataTransformationConfig()
+    def __init__(self, data_transform_configs=None) -> None:
+         self.data_transform_configs = data_transform_configs or DataTransformationConfig()
+
+    def get_artifact_paths(self):
+        return [
+            self.data_transform_configs.train_x_data_enc_path,
+            self.data_transform_configs.train_y_data_enc_path,
+            self.data_transform_configs.test_x_data_enc_path,
+            self.data_transform_configs.test_y_data_enc_path,
+            self.data_transform_configs.gt_enc_path,
+            self.data_transform_configs.columns_values_enc,
+            self.data_transform_configs.preprocessor_obj_path,
+            self.data_transform_configs.compiled_preprocessor_obj_path
+        ]
+
+    def load_transformed_data(self):
+        """Reloads the outputs of a previous transform_data run, in the same order it returns them."""
+        try:
+            self.train_X_encoded = load_array(self.data_transform_configs.train_x_data_enc_path)
+            self.train_y_encoded = load_array(self.data_transform_configs.train_y_data_enc_path)
+            self.test_X_encoded = load_array(self.data_transform_configs.test_x_data_enc_path)
+            self.test_y_encoded = load_array(self.data_transform_configs.test_y_data_enc_path)
+            self.class_labels = load_json(self.data_transform_configs.gt_enc_path)
+
+            return (
+                    self.train_X_encoded,
+                    self.train_y_encoded,
+                    self.test_X_encoded,
+                    self.test_y_encoded,
+                    self.data_transform_configs.preprocessor_obj_path
+            )
+
+        except Exception as e:
+            raise CustomException(e)
 
     def get_data_transformer_obj(self, train_x):
         try:
-            self.categorical_cols = [col for col in train_x.columns if train_x[col].dtypes == object]
-            self.numeric_cols = [col for col in train_x.columns if train_x[col].dtypes != object]
+            self.categorical_cols = [col for col in train_x.columns if is_categorical(train_x[col])]
+            self.numeric_cols = [col for col in train_x.columns if not is_categorical(train_x[col])]
             
             column_values = {col:list(set(train_x[col])) for col in self.categorical_cols}
             for col in self.numeric_cols:
@@ -66,21 +123,39 @@ class DataTransformation:
                 [
                     ("numerical_pipeline", num_pipeline, self.numeric_cols),
                     ("categorical_pipeline", cat_pipleline, self.categorical_cols)
-                ]
+                ],
+                # the config alone decides the format, whatever the density of the output : sparse_output
+                # is saved as .npz and dense as .npy, which DataTransformationConfig and the stage cache expect
+                sparse_threshold=1.0 if self.data_transform_configs.sparse_output else 0.0
             )
 
             return self.preprocessor
 
         except Exception as e:
             raise CustomException(e)
+
+
+    def export_compiled_preprocessor(self, preprocessor):
+        try:
+            compiled_preprocessor = CompiledPreprocessor.from_column_transformer(preprocessor)
+            save_object(
+                file_path=self.data_transform_configs.compiled_preprocessor_obj_path,
+                obj=compiled_preprocessor
+            )
+            logging.info(f"compiled preprocessor saved at {self.data_transform_configs.compiled_preprocessor_obj_path}")
+
+            return self.data_transform_configs.compiled_preprocessor_obj_path
+
+        except Exception as e:
+            raise CustomException(e)
         
 
     def transform_data(self, train_x_path, train_y_path, test_x_path, test_y_path):
         try:
-            train_x = pd.read_csv(train_x_path)
-            train_y = pd.read_csv(train_y_path)
-            test_x = pd.read_csv(test_x_path)
-            test_y = pd.read_csv(test_y_path)
+            train_x = load_dataframe(train_x_path)
+            train_y = load_dataframe(train_y_path)
+            test_x = load_dataframe(test_x_path)
+            test_y = load_dataframe(test_y_path)
         
             logging.info("Read train and test data completed")
 
@@ -94,21 +169,21 @@ class DataTransformation:
             self.class_labels = {c:i for i,c in enumerate(set(train_y["Churn"]))}
 
             self.train_X_encoded = preprocessing_obj.fit_transform(train_x)
-            self.train_y_encoded = train_y["Churn"].map(self.class_labels).values
+            self.train_y_encoded = train_y["Churn"].astype(object).map(self.class_labels).values
             self.test_X_encoded = preprocessing_obj.transform(test_x)
-            self.test_y_encoded = test_y["Churn"].map(self.class_labels).values
+            self.test_y_encoded = test_y["Churn"].astype(object).map(self.class_labels).values
             
 
             logging.info(f"Saving preprocessing objects and encoded datasets...")
 
             # saving train x,y encoded arrays
             os.makedirs(os.path.dirname(self.data_transform_configs.train_x_data_enc_path), exist_ok=True)
-            np.save(self.data_transform_configs.train_x_data_enc_path, self.train_X_encoded)
-            np.save(self.data_transform_configs.train_y_data_enc_path, self.train_y_encoded)
+            save_array(self.data_transform_configs.train_x_data_enc_path, self.train_X_encoded)
+            save_array(self.data_transform_configs.train_y_data_enc_path, self.train_y_encoded)
 
             # saving test x,y encoded arrays
-            np.save(self.data_transform_configs.test_x_data_enc_path, self.test_X_encoded)
-            np.save(self.data_transform_configs.test_y_data_enc_path, self.test_y_encoded)
+            save_array(self.data_transform_configs.test_x_data_enc_path, self.test_X_encoded)
+            save_array(self.data_transform_configs.test_y_data_enc_path, self.test_y_encoded)
 
             # saving class labellings
             save_json(
@@ -123,6 +198,7 @@ class DataTransformation:
                 obj=preprocessing_obj
 
             )
+            self.export_compiled_preprocessor(preprocessing_obj)
             logging.info("DATA TRANSFORMATION DONE ... !!!")
 
             return (
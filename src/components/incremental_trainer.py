@@ -0,0 +1,449 @@
+import os
+import copy
+import json
+import time
+import hashlib
+import shutil
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import clone
+from sklearn.model_selection import train_test_split
+from xgboost import XGBClassifier
+
+import mlflow
+from src.components.data_ingestion import DataIngestion
+from src.components.data_transformation import DataTransformation, get_numeric_scaler, get_scaler_params
+from src.components.compiled_preprocessor import CompiledPreprocessor
+from src.components.data_augmentation import DataAugmentation
+from src.components.model_trainer import ModelTrainer, evaluate_model
+from src.utils import (load_object, save_object, load_json, load_dataframe, save_dataframe,
+                       load_array, save_array, load_sklearn_model)
+from src.instrumentation import StageTimer
+
+from src.logger import logging
+from src.exception import CustomException
+
+
+@dataclass
+class IncrementalTrainingConfig:
+    # model classes whose latest MLflow runs are continued rather than refitted
+    continued_models: tuple = ("LogisticRegression", "XGBClassifier")
+    # boosting rounds added to a continued XGBClassifier
+    xgb_extra_rounds: int = 20
+    # iterations of a warm started LogisticRegression
+    linear_max_iter: int = 100
+    # the new rows are split like DataIngestion splits the raw data
+    test_size: float = 0.2
+    split_random_state: int = 2
+    # update the StandardScaler statistics with the new training rows ; the median imputation values stay as fitted
+    update_scaler: bool = True
+    min_f1_score: float = 0.6
+    # every updated file is written here first and only moved over the current one once the whole run succeeded
+    staging_dir: str = os.path.join("artifacts", "incremental_staging")
+
+
+def get_numeric_rescaling(old_mean, old_scale, new_mean, new_scale):
+    """(a, b) such that a numeric feature standardized with the old statistics equals a * (new standardized value) + b."""
+    return new_scale / old_scale, (new_mean - old_mean) / old_scale
+
+
+def move_thresholds(thresholds, features, a, b, ties_left):
+    """
+    Split thresholds on the new standardization. Values that sat exactly on an old threshold
+    (integer features like tenure often do) only land within float32 rounding of the new
+    one, so thresholds are pushed a few float32 ulps towards the side that keeps those ties
+    on their branch : left for `x <= t` splits, right for `x < t` splits.
+    """
+    moved = (thresholds - b[features]) / a[features]
+    margin = 4 * np.spacing(np.abs(moved).astype(np.float32)).astype(np.float64)
+    return moved + margin if ties_left else moved - margin
+
+
+def rescale_model_inputs(model, a, b):
+    """
+    Copy of `model` that gives on the new standardization of the numeric features (the first
+    len(a) encoded columns) the same outputs `model` gives on the old one : linear models get
+    their weights and intercepts, tree ensembles their split thresholds moved. Returns None
+    for the models that can not be re-expressed, like kernel SVMs.
+    """
+    n_num = len(a)
+    model = copy.deepcopy(model)
+
+    if isinstance(model, XGBClassifier):
+        booster = model.get_booster()
+        booster_json = json.loads(booster.save_raw("json"))
+        for tree in booster_json["learner"]["gradient_booster"]["model"]["trees"]:
+            features = np.asarray(tree["split_indices"])
+            thresholds = np.asarray(tree["split_conditions"], dtype=np.float64)
+            # split_conditions holds the leaf values on the leaves
+            moved = (np.asarray(tree["left_children"]) != -1) & (features < n_num)
+            # xgboost splits are `x < t`
+            thresholds[moved] = move_thresholds(thresholds[moved], features[moved], a, b, ties_left=False)
+            tree["split_conditions"] = thresholds.tolist()
+        booster.load_model(bytearray(json.dumps(booster_json).encode("utf-8")))
+        return model
+
+    if hasattr(model, "estimators_") and all(hasattr(tree, "tree_") for tree in model.estimators_):
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            moved = (tree.children_left != -1) & (tree.feature < n_num)
+            # sklearn splits are `x <= t` ; tree_.threshold is a view on the node array, the tree is edited in place
+            tree.threshold[moved] = move_thresholds(tree.threshold[moved], tree.feature[moved], a, b, ties_left=True)
+        return model
+
+    if hasattr(model, "coef_") and hasattr(model, "intercept_") and not sparse.issparse(model.coef_):
+        model.intercept_ = model.intercept_ + model.coef_[:, :n_num] @ b
+        model.coef_[:, :n_num] *= a
+        return model
+
+    return None
+
+
+def rescale_encoded_array(X, a, b):
+    """Moves the numeric block of an encoded matrix from the old standardization to the new one."""
+    n_num = len(a)
+    if sparse.issparse(X):
+        numeric = (X[:, :n_num].toarray() - b) / a
+        return sparse.hstack([sparse.csr_matrix(numeric), X[:, n_num:]], format="csr")
+    X = np.array(X, dtype=np.float64)
+    X[:, :n_num] = (X[:, :n_num] - b) / a
+    return X
+
+
+def stack_arrays(arrays):
+    if sparse.issparse(arrays[0]):
+        return sparse.vstack(arrays, format="csr")
+    return np.concatenate(arrays)
+
+
+class IncrementalTrainer:
+    """
+    Retrains from a batch of new raw rows instead of from the whole raw csv : the batch is stored
+    next to the raw data for the next full refit, its rows are cleaned, split and appended to the
+    intermediate files and to the encoded store, the StandardScaler statistics are updated with
+    partial_fit (the stored rows and the kept models are moved to the new standardization
+    exactly), and the latest MLflow run of every
+    (dataset, continued model class) pair continues training on the updated data, logged as
+    a new run. The deployed best model is replaced when a continued model beats it.
+
+    Nothing is overwritten before the run succeeds : the updated files are staged and moved
+    in place at the end, and a batch whose content was already stored is refused.
+    """
+    def __init__(self, incremental_training_config=None):
+        self.incremental_training_config = incremental_training_config or IncrementalTrainingConfig()
+        self.data_ingestion = DataIngestion()
+        self.data_transformation = DataTransformation()
+        self.data_augmentation = DataAugmentation()
+        self.model_trainer = ModelTrainer()
+        self.stage_timers = []
+        # target path -> staged path of every file or directory the run updates
+        self.staged_paths = {}
+
+
+    def ingest_new_data(self, new_data_path, preprocessor):
+        """Cleaned feature and target frames of the new raw rows, without the rows with categories unknown to the preprocessor."""
+        df = self.data_ingestion.clean_raw_data(pd.read_csv(new_data_path))
+
+        feature_cols = list(preprocessor.feature_names_in_)
+        missing_cols = [col for col in feature_cols + ["Churn"] if col not in df.columns]
+        if missing_cols:
+            raise ValueError(f"new data is missing the columns {missing_cols}")
+
+        # numeric coded columns come back as numbers, like after the csv round trip of the intermediate files
+        for col in preprocessor.named_transformers_["numerical_pipeline"].feature_names_in_:
+            df[col] = pd.to_numeric(df[col].astype(object))
+
+        categorical_pipeline = preprocessor.named_transformers_["categorical_pipeline"]
+        known = np.ones(len(df), dtype=bool)
+        for col, categories in zip(categorical_pipeline.feature_names_in_, categorical_pipeline.steps[-1][1].categories_):
+            known &= df[col].astype(object).isin(categories).to_numpy()
+        if not known.all():
+            logging.info(f"dropped {int((~known).sum())} new rows with categories unknown to the preprocessor")
+        df = df[known]
+
+        logging.info(f"ingested {len(df)} new rows from {new_data_path}")
+        return df, df[feature_cols], df[["Churn"]]
+
+
+    def get_stored_batches(self):
+        """Raw batches stored by the previous runs, by the content hash ending their names."""
+        return {os.path.splitext(os.path.basename(path))[0].split("_")[-1]: path
+                for path in self.data_ingestion.get_raw_data_paths()[1:]}
+
+
+    def get_staged_path(self, target_path):
+        """Path to write the update of `target_path` to ; the base name is kept, MLflow logs artifacts under it."""
+        staged_path = os.path.join(self.incremental_training_config.staging_dir, str(len(self.staged_paths)), os.path.basename(target_path))
+        os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+        self.staged_paths[target_path] = staged_path
+        return staged_path
+
+
+    def commit_staged_files(self):
+        """Moves the staged files over their targets in staging order ; a staged directory replaces its whole target."""
+        for target_path, staged_path in self.staged_paths.items():
+            target_dir = os.path.dirname(target_path)
+            if target_dir:
+                os.makedirs(target_dir, exist_ok=True)
+            if os.path.isdir(target_path):
+                shutil.rmtree(target_path)
+            os.replace(staged_path, target_path)
+        logging.info(f"moved {len(self.staged_paths)} updated files in place")
+        self.staged_paths = {}
+        shutil.rmtree(self.incremental_training_config.staging_dir, ignore_errors=True)
+
+
+    def store_new_raw_data(self, new_data_path, new_data_hash):
+        """
+        Stages a copy of the new raw csv for DataIngestionConfig.new_raw_data_dir, which
+        DataIngestion reads after the raw data, so that the next full refit re-ingests
+        these rows too. Staged first, it is committed before the derived files.
+        """
+        # timestamped names keep the batches in arrival order, the hash identifies their content
+        stored_path = os.path.join(self.data_ingestion.data_configs.new_raw_data_dir,
+                                   f"{time.strftime('%Y%m%d%H%M%S')}_{new_data_hash}.csv")
+        shutil.copyfile(new_data_path, self.get_staged_path(stored_path))
+        return stored_path
+
+
+    def append_intermediate_data(self, new_df, new_train_x, new_train_y, new_test_x, new_test_y):
+        """Appends the new rows to the intermediate files, so that they cover the stored raw batches without a full re-ingestion."""
+        data_configs = self.data_ingestion.data_configs
+        for file_path, new_rows in [(data_configs.intermediate_raw_data_path, new_df),
+                                    (data_configs.train_x_data_path, new_train_x),
+                                    (data_configs.train_y_data_path, new_train_y),
+                                    (data_configs.test_x_data_path, new_test_x),
+                                    (data_configs.test_y_data_path, new_test_y)]:
+            existing = load_dataframe(file_path)
+            updated = pd.concat([existing, new_rows[existing.columns]], ignore_index=True)
+            if data_configs.intermediate_format != "csv":
+                updated = self.data_ingestion.set_intermediate_dtypes(updated)
+            save_dataframe(self.get_staged_path(file_path), updated)
+
+
+    def update_scaler(self, preprocessor, new_train_x):
+        """partial_fit of the numeric StandardScaler on the imputed new rows ; returns the (a, b) rescaling of the old values."""
+        steps, scaler = get_numeric_scaler(preprocessor)
+        numeric = new_train_x[list(preprocessor.named_transformers_["numerical_pipeline"].feature_names_in_)]
+        for step in steps[:steps.index(scaler)]:
+            numeric = step.transform(numeric)
+
+        old_mean, old_scale = scaler.mean_.copy(), scaler.scale_.copy()
+        scaler.partial_fit(numeric)
+        logging.info(f"scaler updated with {len(new_train_x)} rows : mean {old_mean} -> {scaler.mean_}, scale {old_scale} -> {scaler.scale_}")
+        return get_numeric_rescaling(old_mean, old_scale, scaler.mean_, scaler.scale_)
+
+
+    def get_latest_runs(self):
+        """Latest finished MLflow run of every (dataset, model class) pair whose class is continued,
+        with the (mean, scale) of the scaler it was fitted on, None for runs that did not record it."""
+        experiment = mlflow.get_experiment_by_name(self.model_trainer.model_trainer_config.experiment_name)
+        if experiment is None:
+            return []
+        runs = mlflow.search_runs(experiment_ids=[experiment.experiment_id],
+                                  filter_string="attributes.status = 'FINISHED'",
+                                  order_by=["attributes.start_time DESC"])
+        if runs.empty or "params.model" not in runs:
+            return []
+        runs = runs[runs["params.model"].isin(self.incremental_training_config.continued_models)]
+        if "params.new_data_hash" in runs:
+            # runs of an attempt that failed before committing its batch expect a standardization that was never saved
+            runs = runs[runs["params.new_data_hash"].isna() | runs["params.new_data_hash"].isin(list(self.get_stored_batches()))]
+        runs = runs.drop_duplicates(["params.data", "params.model"])
+        latest_runs = []
+        for run in runs.to_dict("records"):
+            scaler_state = None
+            if isinstance(run.get("params.scaler_mean"), str) and isinstance(run.get("params.scaler_scale"), str):
+                scaler_state = (np.array(json.loads(run["params.scaler_mean"])), np.array(json.loads(run["params.scaler_scale"])))
+            latest_runs.append((run["run_id"], run["params.data"], run["params.model"], scaler_state))
+        return latest_runs
+
+
+    def continue_training(self, model, data_exp_name, train_x, train_y):
+        config = self.incremental_training_config
+        with StageTimer("fit", data=data_exp_name, model=model.__class__.__name__) as fit_timer:
+            fit_timer.rows = train_x.shape[0]
+            if isinstance(model, XGBClassifier):
+                # new boosting rounds on top of the trees of the previous run
+                continued = clone(model).set_params(n_estimators=config.xgb_extra_rounds)
+                continued.fit(train_x, train_y, xgb_model=model.get_booster())
+            else:
+                # solvers start from the previous coefficients
+                continued = copy.deepcopy(model).set_params(warm_start=True, max_iter=config.linear_max_iter)
+                continued.fit(train_x, train_y)
+        return continued, fit_timer
+
+
+    def save_best_model(self, model):
+        """Stages the best model, it replaces the best_model directory when the staged files are committed."""
+        best_model_path = self.model_trainer.model_trainer_config.best_model_path
+        mlflow.sklearn.save_model(model, self.get_staged_path(best_model_path),
+                                  serialization_format=mlflow.sklearn.SERIALIZATION_FORMAT_PICKLE)
+
+
+    def train_incrementally(self, new_data_path):
+        try:
+            config = self.incremental_training_config
+            transform_configs = self.data_transformation.data_transform_configs
+            trainer_configs = self.model_trainer.model_trainer_config
+            mlflow.set_tracking_uri(trainer_configs.local_tracking_uri)
+            mlflow.set_experiment(trainer_configs.experiment_name)
+
+            with open(new_data_path, "rb") as f:
+                new_data_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+            stored_batches = self.get_stored_batches()
+            if new_data_hash in stored_batches:
+                raise ValueError(f"{new_data_path} was already ingested, its rows are stored in {stored_batches[new_data_hash]}")
+            # leftovers of a failed run
+            self.staged_paths = {}
+            shutil.rmtree(config.staging_dir, ignore_errors=True)
+
+            preprocessor = load_object(transform_configs.preprocessor_obj_path)
+            class_labels = load_json(transform_configs.gt_enc_path)
+
+            with StageTimer("incremental_ingestion") as timer:
+                new_df, new_x, new_y = self.ingest_new_data(new_data_path, preprocessor)
+                new_train_x, new_test_x, new_train_y, new_test_y = train_test_split(new_x, new_y,
+                                                                                    test_size=config.test_size,
+                                                                                    stratify=new_y,
+                                                                                    random_state=config.split_random_state)
+                self.store_new_raw_data(new_data_path, new_data_hash)
+                self.append_intermediate_data(new_df, new_train_x, new_train_y, new_test_x, new_test_y)
+                timer.rows = len(new_df)
+            self.stage_timers.append(timer)
+
+            deployed_model = None
+            if os.path.exists(trainer_configs.best_model_path):
+                deployed_model = load_sklearn_model(trainer_configs.best_model_path)
+
+            n_num = len(preprocessor.named_transformers_["numerical_pipeline"].feature_names_in_)
+            a, b = np.ones(n_num), np.zeros(n_num)
+            update_scaler = config.update_scaler
+            if update_scaler and deployed_model is not None and rescale_model_inputs(deployed_model, a, b) is None:
+                # the deployed model has to keep working with the saved preprocessor
+                logging.info(f"the scaler is not updated, the deployed {deployed_model.__class__.__name__} can not be re-expressed on new statistics")
+                update_scaler = False
+
+            with StageTimer("incremental_transformation") as timer:
+                if update_scaler:
+                    a, b = self.update_scaler(preprocessor, new_train_x)
+
+                train_x_enc = stack_arrays([rescale_encoded_array(load_array(transform_configs.train_x_data_enc_path), a, b),
+                                            preprocessor.transform(new_train_x)])
+                test_x_enc = stack_arrays([rescale_encoded_array(load_array(transform_configs.test_x_data_enc_path), a, b),
+                                           preprocessor.transform(new_test_x)])
+                train_y_enc = np.concatenate([load_array(transform_configs.train_y_data_enc_path),
+                                              new_train_y["Churn"].astype(object).map(class_labels).values])
+                test_y_enc = np.concatenate([load_array(transform_configs.test_y_data_enc_path),
+                                             new_test_y["Churn"].astype(object).map(class_labels).values])
+
+                save_array(self.get_staged_path(transform_configs.train_x_data_enc_path), train_x_enc)
+                save_array(self.get_staged_path(transform_configs.train_y_data_enc_path), train_y_enc)
+                save_array(self.get_staged_path(transform_configs.test_x_data_enc_path), test_x_enc)
+                save_array(self.get_staged_path(transform_configs.test_y_data_enc_path), test_y_enc)
+                staged_preprocessor_path = self.get_staged_path(transform_configs.preprocessor_obj_path)
+                save_object(staged_preprocessor_path, preprocessor)
+                save_object(self.get_staged_path(transform_configs.compiled_preprocessor_obj_path),
+                            CompiledPreprocessor.from_column_transformer(preprocessor))
+                timer.rows = train_y_enc.shape[0] + test_y_enc.shape[0]
+            self.stage_timers.append(timer)
+
+            best_model, best_f1_score, best_exp = None, -1, None
+            if deployed_model is not None:
+                deployed_model = rescale_model_inputs(deployed_model, a, b) if update_scaler else deployed_model
+                best_model = deployed_model
+                best_f1_score = evaluate_model("deployed", deployed_model, test_x_enc, test_y_enc)["metrics"]["F1_score"]
+                best_exp = "deployed"
+                logging.info(f"deployed {deployed_model.__class__.__name__} F1 score on the updated test set : {best_f1_score}")
+
+            latest_runs = self.get_latest_runs()
+            if not latest_runs:
+                logging.info(f"no finished run of {config.continued_models} to continue, run the train pipeline first")
+
+            self.data_augmentation.data_augmentation_configs.strategies = tuple(
+                strategy for strategy in self.data_augmentation.data_augmentation_configs.strategies
+                if strategy in {data_exp_name for _, data_exp_name, _, _ in latest_runs}
+            )
+            # the resampled arrays are written to a staging directory, and staged file by file for their own directory
+            augmentation_configs = self.data_augmentation.data_augmentation_configs
+            augmented_data_dir = augmentation_configs.augmented_data_dir
+            augmentation_configs.augmented_data_dir = os.path.join(config.staging_dir, "augmented")
+            datasets = {}
+            for strategy, augmented_x, augmented_y in self.data_augmentation.iter_augmented_data(train_x_enc, train_y_enc):
+                datasets[strategy] = (augmented_x, augmented_y)
+            self.stage_timers.extend(self.data_augmentation.stage_timers)
+            if os.path.isdir(augmentation_configs.augmented_data_dir):
+                for file_name in sorted(os.listdir(augmentation_configs.augmented_data_dir)):
+                    self.staged_paths[os.path.join(augmented_data_dir, file_name)] = os.path.join(augmentation_configs.augmented_data_dir, file_name)
+            augmentation_configs.augmented_data_dir = augmented_data_dir
+
+            _, scaler = get_numeric_scaler(preprocessor)
+            for parent_run_id, data_exp_name, model_name, scaler_state in latest_runs:
+                if data_exp_name not in datasets:
+                    logging.info(f"skipping run {parent_run_id} : dataset {data_exp_name} is not configured")
+                    continue
+                if scaler_state is None or scaler_state[0].shape != scaler.mean_.shape:
+                    logging.info(f"skipping run {parent_run_id} : it has no recorded scaler state, rerun the train pipeline")
+                    continue
+                try:
+                    parent_model = mlflow.sklearn.load_model(f"runs:/{parent_run_id}/model")
+                except Exception as e:
+                    # e.g. runs logged on another machine, whose artifact uri does not resolve here
+                    logging.info(f"skipping run {parent_run_id} : its model can not be loaded ({e})")
+                    continue
+                # the run may have been fitted before earlier scaler updates, it is moved from its own state
+                run_mean, run_scale = scaler_state
+                if np.array_equal(run_mean, scaler.mean_) and np.array_equal(run_scale, scaler.scale_):
+                    model = parent_model
+                else:
+                    model = rescale_model_inputs(parent_model, *get_numeric_rescaling(run_mean, run_scale, scaler.mean_, scaler.scale_))
+                if model is None:
+                    logging.info(f"skipping run {parent_run_id} : its {model_name} can not be re-expressed on new statistics")
+                    continue
+                continued, fit_timer = self.continue_training(model, data_exp_name, *datasets[data_exp_name])
+                run_result = evaluate_model(data_exp_name, continued, test_x_enc, test_y_enc, fit_timer)
+
+                with mlflow.start_run(run_name=run_result["exp_name"]):
+                    mlflow.log_param("data", data_exp_name)
+                    mlflow.log_param("model", model_name)
+                    mlflow.log_param("incremental", True)
+                    mlflow.log_param("parent_run_id", parent_run_id)
+                    mlflow.log_param("new_rows", len(new_df))
+                    mlflow.log_param("new_data_hash", new_data_hash)
+                    mlflow.log_params(get_scaler_params(preprocessor))
+                    mlflow.log_metrics(run_result["metrics"])
+                    mlflow.log_metrics(run_result["timings"])
+                    mlflow.sklearn.log_model(continued, "model")
+                    # the model expects the updated standardization
+                    mlflow.log_artifact(staged_preprocessor_path, "preprocessor")
+
+                current_f1_score = run_result["metrics"]["F1_score"]
+                if current_f1_score > best_f1_score:
+                    best_model, best_f1_score, best_exp = continued, current_f1_score, run_result["exp_name"]
+                logging.info(f"continued {run_result['exp_name']} from run {parent_run_id} ; F1 score {current_f1_score}")
+
+            model_to_save = None
+            if best_f1_score < config.min_f1_score:
+                logging.info(f"The used models are not good enough; Highest f1-score achieved - {best_f1_score}")
+                # the deployed model has to follow the updated scaler
+                if update_scaler and deployed_model is not None:
+                    model_to_save = deployed_model
+                best_model = None
+            elif best_exp != "deployed" or update_scaler:
+                logging.info(f"Saving the best model ; best experiment - {best_exp} ; highest f1 score - {best_f1_score}")
+                model_to_save = best_model
+
+            if model_to_save is not None:
+                self.save_best_model(model_to_save)
+            self.commit_staged_files()
+            if model_to_save is not None:
+                logging.info(f"best model saved at {trainer_configs.best_model_path}")
+                self.model_trainer.export_compiled_model(model_to_save)
+            logging.info("INCREMENTAL TRAINING DONE ... !!!")
+            return best_model
+
+        except Exception as e:
+            raise CustomException(e)
@@ -0,0 +1,61 @@
+import numpy as np
+from scipy import sparse
+
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.kernel_approximation import Nystroem
+from sklearn.linear_model import SGDClassifier
+from sklearn.utils.validation import check_is_fitted
+
+
+class ApproximateRBFSVC(ClassifierMixin, BaseEstimator):
+    """
+    Stand-in for SVC(kernel="rbf", probability=True) that trains and scores in linear time :
+    the RBF kernel is approximated with a Nystroem feature map on `n_components` training
+    rows, a linear SVM (hinge loss, SGD with the regularization of SVC's `C`) is fitted in
+    that feature space, and its decision values are turned into probabilities with Platt
+    (sigmoid) scaling fitted on `calibration_cv` folds, like SVC's probability=True.
+    gamma="scale" uses the same value as SVC.
+    """
+    def __init__(self, C=1.0, gamma="scale", n_components=300, calibration_cv=3, max_iter=1000, random_state=None):
+        self.C = C
+        self.gamma = gamma
+        self.n_components = n_components
+        self.calibration_cv = calibration_cv
+        self.max_iter = max_iter
+        self.random_state = random_state
+
+    def get_gamma(self, X):
+        if self.gamma != "scale":
+            return self.gamma
+        if sparse.issparse(X):
+            X_var = X.multiply(X).mean() - X.mean() ** 2
+        else:
+            X_var = X.var()
+        return 1.0 / (X.shape[1] * X_var) if X_var != 0 else 1.0
+
+    def fit(self, X, y):
+        self.gamma_ = self.get_gamma(X)
+        # the feature map is unsupervised, it is fitted and applied once rather than in every calibration fold
+        self.feature_map_ = Nystroem(kernel="rbf", gamma=self.gamma_, n_components=min(self.n_components, X.shape[0]),
+                                     random_state=self.random_state)
+        X_mapped = self.feature_map_.fit_transform(X)
+
+        linear_svc = SGDClassifier(loss="hinge", alpha=1.0 / (self.C * X.shape[0]), max_iter=self.max_iter,
+                                   random_state=self.random_state)
+        # ensemble=False : the folds only produce the calibration data, a single model is refitted on all rows
+        self.calibrated_svc_ = CalibratedClassifierCV(linear_svc, method="sigmoid", cv=self.calibration_cv, ensemble=False)
+        self.calibrated_svc_.fit(X_mapped, y)
+        self.classes_ = self.calibrated_svc_.classes_
+        return self
+
+    def decision_function(self, X):
+        check_is_fitted(self, "calibrated_svc_")
+        return self.calibrated_svc_.calibrated_classifiers_[0].estimator.decision_function(self.feature_map_.transform(X))
+
+    def predict_proba(self, X):
+        check_is_fitted(self, "calibrated_svc_")
+        return self.calibrated_svc_.predict_proba(self.feature_map_.transform(X))
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
@@ -1,15 +1,23 @@
 import os
 import sys
 from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
+from sklearn.base import clone
+from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.svm import SVC
 from xgboost import XGBClassifier
+from src.components.kernel_approximation import ApproximateRBFSVC
+from src.components.compiled_tree_model import CompiledTreeEnsemble
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_curve, auc
 
 import mlflow
-from src.utils import generate_roc_curves
+from src.utils import generate_roc_curves, resolve_array, resolve_n_jobs, save_object, load_model_metadata
+from src.instrumentation import StageTimer
+from src.tracking import AsyncRunLogger
 
 from src.logger import logging
 from src.exception import CustomException
@@ -23,21 +31,175 @@ class modelTrainingConfig:
     local_tracking_uri: str = os.path.join("mlflow_experiments_log")
     experiment_name: str = "telco-churn-classification"
     roc_plot_file_path: str = os.path.join("plots", "roc_curve_all_models.png")
+    # number of (dataset, model) runs trained at the same time, -1 uses every core
+    n_jobs: int = 1
+    # hand params, metrics and models of every run to a background writer instead of logging them in the training loop
+    async_logging: bool = False
+    # "grid" fully fits every (dataset, model) run ; "successive_halving" fits them on growing subsamples
+    # and only fully fits the best few, see ModelTrainer.iter_halving_results
+    selection_mode: str = "grid"
+    halving_factor: int = 3
+    halving_min_rows: int = 500
+    halving_random_state: int = 0
+    # RBF SVM candidate of the grid : "exact" SVC, "approximate" (ApproximateRBFSVC, linear time in rows) or "both"
+    svc_mode: str = "exact"
+    # flat array copy of a RandomForestClassifier / XGBClassifier best model, see CompiledTreeEnsemble
+    compiled_model_path: str = os.path.join("artifacts", "compiled_model.pkl")
+
+
+def fit_and_evaluate(data_exp_name, model, train_x, train_y, test_X_encoded, test_y_encoded, single_threaded=False):
+    """
+    Fits one (dataset, model) run and computes its test metrics; safe to run in a worker
+    process. LazyArray datasets are only opened here, for the duration of the run.
+    The fit and the test predictions are timed separately, see `timings`.
+    With `single_threaded`, threaded estimators (XGBClassifier, RandomForestClassifier ...)
+    run on one core, the worker pool already uses the others.
+    """
+    # every n_jobs parameter, nested ones included ; restored on the returned model
+    thread_params = {name: value for name, value in model.get_params().items() if name.split("__")[-1] == "n_jobs"}
+    if single_threaded and thread_params:
+        model.set_params(**{name: 1 for name in thread_params})
+
+    with StageTimer("fit", data=data_exp_name, model=model.__class__.__name__) as fit_timer:
+        train_x, train_y = resolve_array(train_x), resolve_array(train_y)
+        fit_timer.rows = train_x.shape[0]
+        model.fit(train_x, train_y)
+
+    run_result = evaluate_model(data_exp_name, model, test_X_encoded, test_y_encoded, fit_timer)
+    if single_threaded and thread_params:
+        model.set_params(**thread_params)
+    return run_result
+
+
+def evaluate_model(data_exp_name, model, test_X_encoded, test_y_encoded, fit_timer=None):
+    """Test metrics and ROC curve of a fitted model, in the format of fit_and_evaluate ; `fit_timer` times its fit."""
+    with StageTimer("predict", data=data_exp_name, model=model.__class__.__name__) as predict_timer:
+        test_X_encoded, test_y_encoded = resolve_array(test_X_encoded), resolve_array(test_y_encoded)
+        predict_timer.rows = test_X_encoded.shape[0]
+        y_pred = model.predict(test_X_encoded)
+        y_pred_prob = model.predict_proba(test_X_encoded)[:,1]
+
+    fpr, tpr, _ = roc_curve(test_y_encoded, y_pred_prob)
+
+    return {
+        "exp_name": data_exp_name+"-"+model.__class__.__name__,
+        "data": data_exp_name,
+        "model": model,
+        "fpr": fpr,
+        "tpr": tpr,
+        "auc": auc(fpr, tpr),
+        "metrics": {
+            "Accuracy": accuracy_score(test_y_encoded, y_pred),
+            "Precision": precision_score(test_y_encoded, y_pred),
+            "Recall": recall_score(test_y_encoded, y_pred),
+            "F1_score": f1_score(test_y_encoded, y_pred)
+        },
+        "timings": {**(fit_timer.get_metrics(prefix="fit_") if fit_timer is not None else {}),
+                    **predict_timer.get_metrics(prefix="predict_")}
+    }
 
 
 class ModelTrainer:
     def __init__(self):
         self.model_trainer_config = modelTrainingConfig()
 
-    def train_and_evaluate_model(self, data_processes, test_X_encoded, test_y_encoded):
+    def get_model_algorithms(self):
+        svc_mode = self.model_trainer_config.svc_mode
+        if svc_mode not in ("exact", "approximate", "both"):
+            raise ValueError(f"unknown svc mode {svc_mode}")
+
+        svc_algorithms = []
+        if svc_mode in ("exact", "both"):
+            svc_algorithms.append(SVC(kernel="rbf", probability=True))
+        if svc_mode in ("approximate", "both"):
+            svc_algorithms.append(ApproximateRBFSVC(random_state=0))
+
+        return [LogisticRegression(),
+                RandomForestClassifier(),
+                *svc_algorithms,
+                XGBClassifier()]
+
+    def iter_fit_results(self, runs, test_X_encoded, test_y_encoded, n_jobs):
+        """Fits every (data_exp_name, model, train_x, train_y) run and yields the results in the order of `runs`."""
+        n_workers = resolve_n_jobs(n_jobs)
+        if n_workers == 1:
+            for data_exp_name, model, train_x, train_y in runs:
+                yield fit_and_evaluate(data_exp_name, model, train_x, train_y, test_X_encoded, test_y_encoded)
+            return
+
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(fit_and_evaluate, data_exp_name, model, train_x, train_y, test_X_encoded, test_y_encoded,
+                                   single_threaded=True)
+                       for data_exp_name, model, train_x, train_y in runs]
+            logging.info(f"submitted {len(futures)} training runs to {n_workers} processes ...")
+            for future in futures:
+                yield future.result()
+
+    def iter_run_results(self, data_processes, test_X_encoded, test_y_encoded, n_jobs):
+        """Yields the result of every (dataset, model) run, always in grid order."""
+        model_algorithms = self.get_model_algorithms()
+        # every run fits its own clone, so a kept best model is never refitted by a later run
+        runs = ((data_exp_name, clone(model), train_x, train_y)
+                for data_exp_name, train_x, train_y in data_processes
+                for model in model_algorithms)
+        yield from self.iter_fit_results(runs, test_X_encoded, test_y_encoded, n_jobs)
+
+    def subsample(self, train_x, train_y, fraction, random_state):
+        """Stratified subsample of `fraction` of the rows, never fewer than halving_min_rows."""
+        train_x, train_y = resolve_array(train_x), resolve_array(train_y)
+        n_rows = max(int(fraction * train_x.shape[0]), self.model_trainer_config.halving_min_rows)
+        if n_rows >= train_x.shape[0]:
+            return train_x, train_y
+        rows, _ = train_test_split(np.arange(train_x.shape[0]), train_size=n_rows, stratify=train_y,
+                                   random_state=random_state)
+        rows.sort()
+        return train_x[rows], train_y[rows]
+
+    def iter_halving_results(self, data_processes, test_X_encoded, test_y_encoded, n_jobs):
+        """
+        Successive halving over the (dataset, model) grid. Every candidate is first fitted on
+        a stratified subsample of its dataset; after each rung only the best 1/halving_factor
+        of them by test F1 move on to a halving_factor times larger subsample, until at most
+        halving_factor candidates are left. Those are fitted on their full datasets and only
+        their results are yielded, in grid order.
+        """
+        factor = self.model_trainer_config.halving_factor
+        model_algorithms = self.get_model_algorithms()
+        candidates = [(data_exp_name, model, train_x, train_y)
+                      for data_exp_name, train_x, train_y in data_processes
+                      for model in model_algorithms]
+
+        n_rungs = 0
+        n_candidates = len(candidates)
+        while n_candidates > factor:
+            n_candidates = int(np.ceil(n_candidates / factor))
+            n_rungs += 1
+
+        for rung in range(n_rungs):
+            fraction = factor ** (rung - n_rungs)
+            runs = [(data_exp_name, clone(model), *self.subsample(train_x, train_y, fraction, self.model_trainer_config.halving_random_state))
+                    for data_exp_name, model, train_x, train_y in candidates]
+            f1_scores = [result["metrics"]["F1_score"] for result in self.iter_fit_results(runs, test_X_encoded, test_y_encoded, n_jobs)]
+
+            n_kept = int(np.ceil(len(candidates) / factor))
+            kept = sorted(np.argsort(f1_scores, kind="stable")[::-1][:n_kept])
+            logging.info(f"successive halving rung {rung} ({fraction:.3f} of the training rows) : " +
+                         ", ".join(f"{name}-{model.__class__.__name__}={f1:.4f}" for (name, model, _, _), f1 in zip(candidates, f1_scores)) +
+                         f" ; keeping {[candidates[i][0] + '-' + candidates[i][1].__class__.__name__ for i in kept]}")
+            candidates = [candidates[i] for i in kept]
+
+        runs = [(data_exp_name, clone(model), train_x, train_y) for data_exp_name, model, train_x, train_y in candidates]
+        yield from self.iter_fit_results(runs, test_X_encoded, test_y_encoded, n_jobs)
+
+    def train_and_evaluate_model(self, data_processes, test_X_encoded, test_y_encoded, n_jobs=None, run_params=None):
+        """run_params are logged with every run, e.g. the scaler state the encoded data comes from."""
         try:
             mlflow.set_tracking_uri(self.model_trainer_config.local_tracking_uri)
-            mlflow.set_experiment(self.model_trainer_config.experiment_name)
-
-            model_algorithms = [LogisticRegression(),
-                                RandomForestClassifier(),
-                                SVC(kernel="rbf", probability=True),
-                                XGBClassifier()]
+            experiment = mlflow.set_experiment(self.model_trainer_config.experiment_name)
+            n_jobs = n_jobs or self.model_trainer_config.n_jobs
+            run_logger = None
+            if self.model_trainer_config.async_logging:
+                run_logger = AsyncRunLogger(self.model_trainer_config.local_tracking_uri, experiment.experiment_id)
             
             all_fpr = []
             all_tpr = []
@@ -48,49 +210,61 @@ class ModelTrainer:
             self.best_f1_score = -1
             self.best_exp = None
 
-            for data_exp_name, train_x, train_y in data_processes:
-                for model in model_algorithms:
-                    exp_name = data_exp_name+"-"+model.__class__.__name__
-                    with mlflow.start_run(run_name=exp_name):
-                        
-                        model.fit(train_x, train_y)
-                        y_pred = model.predict(test_X_encoded)
-
-                        y_pred_prob = model.predict_proba(test_X_encoded)[:,1]
-                        fpr, tpr, _ = roc_curve(test_y_encoded, y_pred_prob)
-                        auc_score = auc(fpr, tpr)
+            try:
+                if self.model_trainer_config.selection_mode == "successive_halving":
+                    run_results = self.iter_halving_results(data_processes, test_X_encoded, test_y_encoded, n_jobs)
+                elif self.model_trainer_config.selection_mode == "grid":
+                    run_results = self.iter_run_results(data_processes, test_X_encoded, test_y_encoded, n_jobs)
+                else:
+                    raise ValueError(f"unknown selection mode {self.model_trainer_config.selection_mode}")
 
-                        experiment_names.append(exp_name)
-                        all_fpr.append(fpr)
-                        all_tpr.append(tpr)
-                        all_auc.append(auc_score)
+                # runs are logged and compared in grid order, so the selected model does not depend on n_jobs
+                for run_result in run_results:
+                    exp_name = run_result["exp_name"]
+                    model = run_result["model"]
 
-                        mlflow.log_param("data", data_exp_name)
-                        mlflow.log_param("model", model.__class__.__name__)
+                    experiment_names.append(exp_name)
+                    all_fpr.append(run_result["fpr"])
+                    all_tpr.append(run_result["tpr"])
+                    all_auc.append(run_result["auc"])
 
-                        current_f1_score = f1_score(test_y_encoded, y_pred)
+                    if run_logger is not None:
+                        run_logger.log_run(exp_name,
+                                           params={"data": run_result["data"], "model": model.__class__.__name__, **(run_params or {})},
+                                           metrics={**run_result["metrics"], **run_result["timings"]},
+                                           model=model)
+                    else:
+                        with mlflow.start_run(run_name=exp_name):
+                            mlflow.log_param("data", run_result["data"])
+                            mlflow.log_param("model", model.__class__.__name__)
+                            mlflow.log_params(run_params or {})
 
-                        mlflow.log_metric("Accuracy", accuracy_score(test_y_encoded, y_pred))
-                        mlflow.log_metric("Precision", precision_score(test_y_encoded, y_pred))
-                        mlflow.log_metric("Recall", recall_score(test_y_encoded, y_pred))
-                        mlflow.log_metric("F1_score", current_f1_score)
+                            for metric_name, metric_value in run_result["metrics"].items():
+                                mlflow.log_metric(metric_name, metric_value)
+                            mlflow.log_metrics(run_result["timings"])
                         
-                        mlflow.sklearn.log_model(model, "model")
+                            mlflow.sklearn.log_model(model, "model")
 
-                        if current_f1_score > self.best_f1_score:
-                            self.best_model = model
-                            self.best_f1_score = current_f1_score
-                            self.best_exp = exp_name
+                    current_f1_score = run_result["metrics"]["F1_score"]
+                    if current_f1_score > self.best_f1_score:
+                        self.best_model = model
+                        self.best_f1_score = current_f1_score
+                        self.best_exp = exp_name
 
-                        logging.info(f"finished experiment {exp_name}. Currently best F1 score : {self.best_f1_score}")
+                    logging.info(f"finished experiment {exp_name}. Currently best F1 score : {self.best_f1_score}")
             
-            generate_roc_curves(experiment_names=experiment_names,
-                                all_fpr=all_fpr,
-                                all_tpr=all_tpr,
-                                all_auc=all_auc,
-                                plot_file_name=self.model_trainer_config.roc_plot_file_path)
+                generate_roc_curves(experiment_names=experiment_names,
+                                    all_fpr=all_fpr,
+                                    all_tpr=all_tpr,
+                                    all_auc=all_auc,
+                                    plot_file_name=self.model_trainer_config.roc_plot_file_path)
             
-            mlflow.log_artifact(self.model_trainer_config.roc_plot_file_path, "roc_curves")
+                mlflow.log_artifact(self.model_trainer_config.roc_plot_file_path, "roc_curves")
+            finally:
+                # also when a fit or the plot fails, so that the queued runs are written and terminated
+                if run_logger is not None:
+                    logging.info("waiting for the background mlflow writer ...")
+                    run_logger.close()
 
             if self.best_f1_score < 0.6:
                 logging.info(f"The used models are not good enough; Highest f1-score achieved - {self.best_f1_score}")
@@ -101,9 +275,34 @@ class ModelTrainer:
                     mlflow.sklearn.save_model(self.best_model, 
                                             self.model_trainer_config.best_model_path, 
                                             serialization_format=mlflow.sklearn.SERIALIZATION_FORMAT_PICKLE)
+                    self.export_compiled_model(self.best_model)
                 else:
                     logging.info("Skipping saving as best model is already saved ...")
                 return self.best_model
 
         except Exception as e:
-            raise CustomException(e)
\ No newline at end of file
+            raise CustomException(e)
+
+
+    def export_compiled_model(self, model):
+        """
+        Saves the CompiledTreeEnsemble of a tree ensemble best model next to it, tagged with
+        the model_uuid of the saved best_model so that inference never pairs it with another
+        model. Other models have no compiled form and any stale one is removed.
+        """
+        try:
+            compiled_model_path = self.model_trainer_config.compiled_model_path
+            if not isinstance(model, (RandomForestClassifier, XGBClassifier)):
+                if os.path.exists(compiled_model_path):
+                    os.remove(compiled_model_path)
+                logging.info(f"{model.__class__.__name__} is not a tree ensemble, no compiled model exported")
+                return None
+
+            model_uuid = load_model_metadata(self.model_trainer_config.best_model_path).get("model_uuid")
+            compiled_model = CompiledTreeEnsemble.from_model(model, source_model_uuid=str(model_uuid))
+            save_object(compiled_model_path, compiled_model)
+            logging.info(f"compiled model of {len(compiled_model.roots)} trees saved at {compiled_model_path}")
+            return compiled_model
+
+        except Exception as e:
+            raise CustomException(e)
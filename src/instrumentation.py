@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import threading
+
+import numpy as np
+
+from src.logger import logging
+
+
+def get_current_rss_mb():
+    """Resident memory of the process right now ; None where /proc is not available."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def get_max_rss_mb():
+    """High-water mark of the resident memory of the process (since the last reset_peak_rss on linux)."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # kilobytes on linux, never reset
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss():
+    """Resets the resident memory high-water mark of the process to its current RSS; False when not supported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+# StageTimer blocks currently open in this process, outermost first
+_open_timers = []
+
+
+class StageTimer:
+    """
+    Context manager recording the wall time, CPU time, peak RSS, RSS at the end and rows
+    per second of the code it wraps, then emitting them as one structured log record :
+
+        with StageTimer("data_transformation", rows=len(train_x)) as timer:
+            ...
+        mlflow.log_metrics(timer.get_metrics(prefix="data_transformation_"))
+
+    `rows` can also be set inside the block, once known. The peak RSS is read from the
+    kernel high-water mark, which is reset when a timer starts; nested timers hand their
+    peak over to the enclosing ones so that resetting it loses nothing.
+    """
+    def __init__(self, stage_name, rows=None, **tags):
+        self.stage_name = stage_name
+        self.rows = rows
+        self.tags = tags
+        self.metrics = {}
+
+    def __enter__(self):
+        peak_rss_mb = get_max_rss_mb()
+        for timer in _open_timers:
+            timer.peak_rss_mb = max(timer.peak_rss_mb, peak_rss_mb)
+        reset_peak_rss()
+        self.peak_rss_mb = get_max_rss_mb() or 0.0
+        _open_timers.append(self)
+
+        self.start_wall, self.start_cpu = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_s, cpu_s = time.perf_counter() - self.start_wall, time.process_time() - self.start_cpu
+        self.peak_rss_mb = max(self.peak_rss_mb, get_max_rss_mb() or 0.0)
+        _open_timers.remove(self)
+        for timer in _open_timers:
+            timer.peak_rss_mb = max(timer.peak_rss_mb, self.peak_rss_mb)
+
+        self.metrics = {
+            "wall_s": wall_s,
+            "cpu_s": cpu_s,
+            "peak_rss_mb": self.peak_rss_mb,
+        }
+        # what the stage leaves resident, next to what it needed at its peak
+        end_rss_mb = get_current_rss_mb()
+        if end_rss_mb is not None:
+            self.metrics["end_rss_mb"] = end_rss_mb
+        if self.rows is not None:
+            self.metrics["rows"] = self.rows
+            self.metrics["rows_per_s"] = self.rows / wall_s if wall_s > 0 else 0.0
+
+        record = {"stage": self.stage_name, **self.tags, **self.metrics, "failed": exc_type is not None}
+        logging.info(f"stage_metrics {json.dumps(record)}", extra={"stage_metrics": record})
+
+    def get_metrics(self, prefix=""):
+        return {prefix + name: float(value) for name, value in self.metrics.items()}
+
+
+def log_stage_metrics(stage_timers, run_name="pipeline-stages"):
+    """
+    Logs the metrics of finished StageTimers to MLflow, prefixed with their stage names,
+    on the active run or else on a new run named `run_name`.
+    """
+    import mlflow
+
+    metrics = {}
+    for timer in stage_timers:
+        metrics.update(timer.get_metrics(prefix=f"{timer.stage_name}_"))
+
+    if mlflow.active_run() is not None:
+        mlflow.log_metrics(metrics)
+    else:
+        with mlflow.start_run(run_name=run_name):
+            mlflow.log_metrics(metrics)
+
+
+class LatencyHistogram:
+    """
+    Thread-safe histogram of call latencies over fixed, log-spaced millisecond buckets
+    (0.05ms to 60s); percentiles are read from the bucket upper bounds.
+    """
+    bucket_bounds_ms = np.geomspace(0.05, 60_000, 61)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # last bucket counts the calls slower than the highest bound
+        self.counts = np.zeros(len(self.bucket_bounds_ms) + 1, dtype=np.int64)
+        self.total_ms = 0.0
+        self.total_rows = 0
+
+    def observe(self, seconds, rows=1):
+        latency_ms = seconds * 1000
+        bucket = np.searchsorted(self.bucket_bounds_ms, latency_ms)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.total_ms += latency_ms
+            self.total_rows += rows
+
+    def percentile(self, q):
+        with self.lock:
+            counts = self.counts.copy()
+        if counts.sum() == 0:
+            return None
+        bucket = np.searchsorted(np.cumsum(counts), q / 100 * counts.sum())
+        return float(self.bucket_bounds_ms[min(bucket, len(self.bucket_bounds_ms) - 1)])
+
+    def summary(self):
+        with self.lock:
+            calls = int(self.counts.sum())
+            buckets = {f"le_{bound:.4g}ms": int(count) for bound, count in zip(self.bucket_bounds_ms, self.counts) if count}
+            if self.counts[-1]:
+                buckets["gt_60000ms"] = int(self.counts[-1])
+            total_ms, total_rows = self.total_ms, self.total_rows
+
+        return {
+            "calls": calls,
+            "rows": total_rows,
+            "mean_ms": total_ms / calls if calls else None,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "buckets": buckets
+        }
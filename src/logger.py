@@ -4,15 +4,22 @@ from datetime import datetime
 
 LOG_FILE = f"{datetime.now().strftime('%d-%m-%Y')}.log"
 LOG_DIR = os.path.join(os.getcwd(), 'Logs')
-os.makedirs(LOG_DIR, exist_ok=True)
 
 LOG_FILE_PATH = os.path.join(LOG_DIR, LOG_FILE)
 
+
+class LazyFileHandler(logging.FileHandler):
+    """Creates the Logs directory and opens the log file with the first record, not on import."""
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
 logging.basicConfig(
     level=logging.DEBUG,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler(LOG_FILE_PATH),
+        LazyFileHandler(LOG_FILE_PATH, delay=True),
         logging.StreamHandler()  # This handler will output to the console
     ]
 )
@@ -0,0 +1,292 @@
+import os
+import sys
+import time
+import platform
+import subprocess
+import tracemalloc
+from datetime import datetime
+from dataclasses import dataclass, field, asdict
+
+import numpy as np
+import pandas as pd
+
+from src.components.data_ingestion import DataIngestion, DataIngestionConfig
+from src.components.data_transformation import DataTransformation, DataTransformationConfig
+from src.components.data_augmentation import DataAugmentation, DataAugmentationConfig
+from src.components.model_trainer import ModelTrainer, fit_and_evaluate
+from src.pipeline.predict_pipeline import ChurnInference, InferenceConfig
+from src.utils import load_json, load_dataframe, save_json
+from src.instrumentation import StageTimer, get_max_rss_mb
+from src.logger import logging
+from src.exception import CustomException
+
+
+@dataclass
+class BenchmarkConfig:
+    # numbers of synthetic raw rows; 7_043 is the size of the real Telco dataset
+    scales: tuple = (7_043, 100_000, 1_000_000, 10_000_000)
+    column_values_path: str = os.path.join("data", "encoded", "column_unique_values.json")
+    work_dir: str = os.path.join("artifacts", "benchmarks", "work")
+    results_dir: str = os.path.join("artifacts", "benchmarks")
+
+    # share of rows with a blank TotalCharges, as in the raw data
+    blank_total_charges_rate: float = 0.0016
+    generation_chunk_rows: int = 1_000_000
+    random_state: int = 0
+
+    sparse_output: bool = False
+    augmentation_strategies: tuple = ("undersampled", "oversampled", "smoted")
+    # stages on more training rows than this run on the first `max_rows` of them, the results keep the real row count
+    max_rows: dict = field(default_factory=lambda: {"augmentation": 1_000_000, "training": 10_000})
+    inference_batch_rows: int = 100_000
+    single_row_repeats: int = 200
+    # tracemalloc also gives the peak of python / numpy allocations, but slows pandas down several times
+    trace_memory: bool = False
+
+
+def get_environment_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    import sklearn, xgboost, imblearn
+    return {
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": {
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "scikit-learn": sklearn.__version__,
+            "xgboost": xgboost.__version__,
+            "imbalanced-learn": imblearn.__version__
+        }
+    }
+
+
+class ChurnBenchmark:
+    def __init__(self, benchmark_config=None):
+        self.benchmark_config = benchmark_config or BenchmarkConfig()
+        self.results = []
+
+    def generate_dataset(self, n_rows, file_path):
+        """
+        Writes `n_rows` Telco-shaped raw rows to `file_path` (csv), in chunks. Categorical
+        values are drawn from column_unique_values.json, numeric columns within the ranges
+        of the real data, with TotalCharges close to tenure * MonthlyCharges. Churn follows
+        contract, tenure and internet service like in the real data (about 27% churners),
+        so that the models train on a learnable signal rather than on noise.
+        """
+        try:
+            column_values = load_json(self.benchmark_config.column_values_path)
+            rng = np.random.default_rng(self.benchmark_config.random_state)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+            chunk_rows = self.benchmark_config.generation_chunk_rows
+            for start in range(0, n_rows, chunk_rows):
+                size = min(chunk_rows, n_rows - start)
+                tenure = rng.integers(0, 73, size)
+                monthly_charges = np.round(rng.uniform(18.25, 118.75, size), 2)
+                total_charges = np.round(np.maximum(tenure, 1) * monthly_charges * rng.uniform(0.9, 1.1, size), 2)
+
+                chunk = {"customerID": np.char.add("SYN-", np.arange(start, start + size).astype(str))}
+                for col, values in column_values.items():
+                    if values:
+                        chunk[col] = rng.choice(np.array(values, dtype=object), size)
+                chunk["SeniorCitizen"] = (rng.random(size) < 0.16).astype(int)
+                chunk["tenure"] = tenure
+                chunk["MonthlyCharges"] = monthly_charges
+                chunk["TotalCharges"] = total_charges.astype(str)
+                chunk["TotalCharges"][rng.random(size) < self.benchmark_config.blank_total_charges_rate] = " "
+                churn_logit = (-0.45 + 1.2 * (chunk["Contract"] == "Month-to-month") - 0.04 * tenure
+                               + 0.8 * (chunk["InternetService"] == "Fiber optic"))
+                chunk["Churn"] = np.where(rng.random(size) < 1 / (1 + np.exp(-churn_logit)), "Yes", "No")
+
+                pd.DataFrame(chunk).to_csv(file_path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+
+            logging.info(f"generated {n_rows} synthetic rows at {file_path}")
+            return file_path
+
+        except Exception as e:
+            raise CustomException(e)
+
+
+    def measure(self, scale, stage, rows, run_stage):
+        """Runs `run_stage()` and records its wall / cpu time, throughput and peak memory."""
+        if self.benchmark_config.trace_memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+            start_traced = tracemalloc.get_traced_memory()[0]
+
+        with StageTimer(stage, rows=rows, scale=scale) as timer:
+            output = run_stage()
+
+        result = {"scale": scale, "stage": stage, **timer.metrics, "peak_traced_mb": None}
+        if self.benchmark_config.trace_memory:
+            result["peak_traced_mb"] = (tracemalloc.get_traced_memory()[1] - start_traced) / 2**20
+            tracemalloc.stop()
+
+        self.results.append(result)
+        logging.info(f"[benchmark] scale {scale} - {stage} : {timer.metrics['wall_s']:.3f}s for {rows} rows")
+        return output
+
+
+    def measure_latency(self, scale, stage, run_once):
+        """Times `single_row_repeats` calls of `run_once()` one by one and records latency percentiles."""
+        latencies = []
+        for _ in range(self.benchmark_config.single_row_repeats):
+            start = time.perf_counter()
+            run_once()
+            latencies.append(time.perf_counter() - start)
+
+        latencies_ms = np.array(latencies) * 1000
+        result = {
+            "scale": scale,
+            "stage": stage,
+            "rows": 1,
+            "wall_s": float(latencies_ms.sum() / 1000),
+            "calls": len(latencies),
+            "latency_ms_p50": float(np.percentile(latencies_ms, 50)),
+            "latency_ms_p95": float(np.percentile(latencies_ms, 95)),
+            "latency_ms_p99": float(np.percentile(latencies_ms, 99)),
+            "max_rss_mb": get_max_rss_mb()
+        }
+        self.results.append(result)
+        logging.info(f"[benchmark] scale {scale} - {stage} : p50 {result['latency_ms_p50']:.2f}ms")
+
+
+    def run_scale(self, scale):
+        try:
+            config = self.benchmark_config
+            scale_dir = os.path.join(config.work_dir, str(scale))
+            max_rows = config.max_rows
+
+            # ingestion, on a freshly generated raw file
+            ingestion_config = DataIngestionConfig(
+                raw_data_path=os.path.join(scale_dir, "raw", "synthetic_telco.csv"),
+                new_raw_data_dir=os.path.join(scale_dir, "raw", "new"),
+                intermediate_raw_data_path=os.path.join(scale_dir, "intermediate", "intermediate_data.csv"),
+                train_x_data_path=os.path.join(scale_dir, "intermediate", "train_x.csv"),
+                train_y_data_path=os.path.join(scale_dir, "intermediate", "train_y.csv"),
+                test_x_data_path=os.path.join(scale_dir, "intermediate", "test_x.csv"),
+                test_y_data_path=os.path.join(scale_dir, "intermediate", "test_y.csv")
+            )
+            self.generate_dataset(scale, ingestion_config.raw_data_path)
+            paths = self.measure(scale, "ingestion", scale, DataIngestion(ingestion_config).ingest_data)
+
+            # transformation
+            encoded_dir = os.path.join(scale_dir, "encoded")
+            transformation_config = DataTransformationConfig(
+                train_x_data_enc_path=os.path.join(encoded_dir, "train_x_oh_encoded.npy"),
+                train_y_data_enc_path=os.path.join(encoded_dir, "train_y_encoded.npy"),
+                test_x_data_enc_path=os.path.join(encoded_dir, "test_x_oh_encoded.npy"),
+                test_y_data_enc_path=os.path.join(encoded_dir, "test_y_encoded.npy"),
+                gt_enc_path=os.path.join(encoded_dir, "class_encodings.json"),
+                preprocessor_obj_path=os.path.join(scale_dir, "preprocessor.pkl"),
+                compiled_preprocessor_obj_path=os.path.join(scale_dir, "compiled_preprocessor.pkl"),
+                sparse_output=config.sparse_output
+            )
+            transformation_config.columns_values_enc = os.path.join(encoded_dir, "column_unique_values.json")
+            train_x, train_y, test_x, test_y, _ = self.measure(
+                scale, "transformation", scale, lambda: DataTransformation(transformation_config).transform_data(*paths)
+            )
+
+            # augmentation, one strategy at a time
+            augmentation_rows = min(train_x.shape[0], max_rows.get("augmentation", train_x.shape[0]))
+            data_augmentation = DataAugmentation(DataAugmentationConfig(
+                augmented_data_dir=os.path.join(scale_dir, "augmented"),
+                strategies=config.augmentation_strategies
+            ))
+            for strategy in config.augmentation_strategies:
+                self.measure(scale, f"augmentation_{strategy}", augmentation_rows,
+                             lambda: data_augmentation.resample(strategy, train_x[:augmentation_rows], train_y[:augmentation_rows]))
+
+            # training, every model of the grid on the original training data
+            training_rows = min(train_x.shape[0], max_rows.get("training", train_x.shape[0]))
+            for model in ModelTrainer().get_model_algorithms():
+                self.measure(scale, f"training_{model.__class__.__name__}", training_rows,
+                             lambda: fit_and_evaluate("original", model, train_x[:training_rows], train_y[:training_rows], test_x, test_y))
+            del train_x, train_y, test_x, test_y
+
+            # inference, with the deployed preprocessor and model
+            test_df = load_dataframe(paths[2])
+            batch_df = test_df.iloc[:config.inference_batch_rows]
+            for use_compiled_preprocessor in (False, True):
+                suffix = "_compiled" if use_compiled_preprocessor else ""
+                inference = ChurnInference(InferenceConfig(use_compiled_preprocessor=use_compiled_preprocessor))
+                single_row_df = test_df.iloc[:1]
+                self.measure_latency(scale, f"inference_single_row{suffix}",
+                                     lambda: inference.predict_churn(single_row_df.copy()))
+                self.measure(scale, f"inference_batch{suffix}", len(batch_df),
+                             lambda: inference.predict_churn(batch_df.copy()))
+
+        except Exception as e:
+            raise CustomException(e)
+
+
+    def run(self):
+        """Benchmarks every configured scale and writes the results to a timestamped json file."""
+        try:
+            started_at = datetime.now()
+            for scale in self.benchmark_config.scales:
+                logging.info(f"[benchmark] starting scale {scale} ...")
+                self.run_scale(scale)
+
+            results_path = os.path.join(self.benchmark_config.results_dir,
+                                        f"benchmark_{started_at.strftime('%Y%m%d-%H%M%S')}.json")
+            save_json(
+                file_path=results_path,
+                obj={
+                    "started_at": started_at.isoformat(timespec="seconds"),
+                    "environment": get_environment_info(),
+                    "config": asdict(self.benchmark_config),
+                    "results": self.results
+                }
+            )
+            logging.info(f"benchmark results saved at {results_path}")
+            return results_path
+
+        except Exception as e:
+            raise CustomException(e)
+
+
+def compare_benchmarks(baseline_path, current_path):
+    """
+    Joins two result files on (scale, stage); `speedup` > 1 means the current run is
+    faster than the baseline.
+    """
+    try:
+        baseline = {(r["scale"], r["stage"]): r for r in load_json(baseline_path)["results"]}
+        comparison = []
+        for result in load_json(current_path)["results"]:
+            key = (result["scale"], result["stage"])
+            if key not in baseline:
+                continue
+            metric = "latency_ms_p50" if "latency_ms_p50" in result else "wall_s"
+            comparison.append({
+                "scale": result["scale"],
+                "stage": result["stage"],
+                "metric": metric,
+                "baseline": baseline[key][metric],
+                "current": result[metric],
+                "speedup": baseline[key][metric] / result[metric] if result[metric] else None
+            })
+        return pd.DataFrame(comparison)
+
+    except Exception as e:
+        raise CustomException(e)
+
+
+if __name__ == "__main__":
+    # python src/pipeline/benchmark_pipeline.py [--scales 7043,100000] [--compare baseline.json]
+    args = sys.argv[1:]
+    benchmark_config = BenchmarkConfig()
+    if "--scales" in args:
+        benchmark_config.scales = tuple(int(scale) for scale in args[args.index("--scales") + 1].split(","))
+
+    results_path = ChurnBenchmark(benchmark_config).run()
+
+    if "--compare" in args:
+        print(compare_benchmarks(args[args.index("--compare") + 1], results_path).to_string(index=False))
@@ -0,0 +1,20 @@
+import sys
+
+from src.components.incremental_trainer import IncrementalTrainer
+from src.instrumentation import StageTimer, log_stage_metrics
+
+
+# continues the models of the last train_pipeline run with a batch of new customers instead of refitting
+# everything from the raw csv ; the batch is a csv in the raw data format, including the Churn column
+if len(sys.argv) < 2:
+    sys.exit("usage : python src/pipeline/incremental_train_pipeline.py <new raw data csv> [--keep-scaler]")
+new_data_path = sys.argv[1]
+
+incremental_trainer = IncrementalTrainer()
+# pass --keep-scaler to standardize the new rows with the saved statistics instead of updating them
+if "--keep-scaler" in sys.argv:
+    incremental_trainer.incremental_training_config.update_scaler = False
+
+with StageTimer("incremental_training") as timer:
+    best_model = incremental_trainer.train_incrementally(new_data_path)
+log_stage_metrics([timer] + incremental_trainer.stage_timers, run_name="incremental-pipeline-stages")
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+
+class InputSchema:
+    """
+    Typed view of the columns the fitted preprocessor expects. `validate` converts a raw
+    batch once into compact dtypes, categoricals with the fixed category sets of the
+    one-hot encoder and float32 numerics, and reports the values that can not be
+    converted per row and column instead of failing the whole batch inside the transform.
+    Missing values are accepted, the preprocessor imputes them.
+    """
+    error_columns = ["row", "column", "value", "error"]
+
+    def __init__(self, numeric_cols, categorical_cols, categories):
+        self.numeric_cols = list(numeric_cols)
+        self.categorical_cols = list(categorical_cols)
+        self.categorical_dtypes = {col: pd.CategoricalDtype(pd.Index(cats)) for col, cats in zip(self.categorical_cols, categories)}
+        self.columns = self.numeric_cols + self.categorical_cols
+
+
+    @classmethod
+    def from_preprocessor(cls, preprocessor, column_values=None):
+        """
+        Builds the schema of a fitted ColumnTransformer or CompiledPreprocessor. The category
+        sets are the ones the encoder was fitted on ; `column_values` (the content of
+        column_unique_values.json) is checked against them, so stale artifacts fail here.
+        """
+        if hasattr(preprocessor, "named_transformers_"):
+            numeric_cols = list(preprocessor.named_transformers_["numerical_pipeline"].feature_names_in_)
+            categorical_pipeline = preprocessor.named_transformers_["categorical_pipeline"]
+            categorical_cols = list(categorical_pipeline.feature_names_in_)
+            categories = categorical_pipeline.steps[-1][1].categories_
+        else:
+            numeric_cols = preprocessor.numeric_cols
+            categorical_cols = preprocessor.categorical_cols
+            categories = preprocessor.categories
+
+        if column_values is not None:
+            if set(column_values) != set(numeric_cols) | set(categorical_cols):
+                raise ValueError(f"column values {sorted(column_values)} do not match the preprocessor columns "
+                                 f"{sorted(numeric_cols + categorical_cols)}")
+            for col, cats in zip(categorical_cols, categories):
+                unknown = set(column_values[col]) - set(cats)
+                if unknown:
+                    raise ValueError(f"values {sorted(unknown)} of column {col} are unknown to the preprocessor")
+
+        return cls(numeric_cols, categorical_cols, categories)
+
+
+    def validate(self, df):
+        """
+        Returns the batch restricted to the schema columns with typed dtypes, and a frame
+        of errors with the positional row, column, offending value and reason of every
+        value that could not be converted ; those values are missing in the typed frame.
+        Raises only when whole columns are missing.
+        """
+        missing_cols = [col for col in self.columns if col not in df.columns]
+        if missing_cols:
+            raise ValueError(f"input is missing the columns {missing_cols}")
+
+        typed_columns = {}
+        errors = []
+        for col in self.numeric_cols:
+            values = df[col]
+            if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+                numeric = values.to_numpy(dtype=np.float64)
+                invalid = np.isinf(numeric)
+            else:
+                numeric = pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64)
+                invalid = np.isinf(numeric)
+                # only the few values that did not parse are inspected ; blank strings are
+                # missing values, like in the raw TotalCharges column
+                not_parsed = np.flatnonzero(np.isnan(numeric))
+                if len(not_parsed):
+                    raw = values.iloc[not_parsed]
+                    invalid[not_parsed] = (raw.notna() & (raw.astype(str).str.strip() != "")).to_numpy()
+            numeric[invalid] = np.nan
+            typed_columns[col] = numeric.astype(np.float32)
+            errors.append(self.get_errors(values, col, invalid, "not a finite number"))
+
+        for col in self.categorical_cols:
+            values = df[col]
+            typed = pd.Categorical(values, dtype=self.categorical_dtypes[col])
+            invalid = typed.codes < 0
+            if invalid.any():
+                invalid[invalid] = values[invalid].notna().to_numpy()
+            typed_columns[col] = typed
+            errors.append(self.get_errors(values, col, invalid, "unknown category"))
+
+        typed_df = pd.DataFrame(typed_columns, index=df.index)[self.columns]
+        errors = [error for error in errors if len(error)]
+        errors = pd.concat(errors, ignore_index=True) if errors else pd.DataFrame(columns=self.error_columns)
+        return typed_df, errors.sort_values("row", kind="stable", ignore_index=True)
+
+
+    def get_errors(self, values, col, invalid, reason):
+        rows = np.flatnonzero(invalid)
+        return pd.DataFrame({"row": rows,
+                             "column": col,
+                             "value": values.to_numpy(dtype=object)[rows],
+                             "error": reason},
+                            columns=self.error_columns)
+
+
+    @staticmethod
+    def get_row_messages(errors, n_rows):
+        """One message per input row listing its errors, None for the valid rows."""
+        messages = np.full(n_rows, None, dtype=object)
+        if len(errors):
+            row_errors = (errors["column"] + ": " + errors["error"] + " " + errors["value"].map(repr)).groupby(errors["row"]).agg("; ".join)
+            messages[row_errors.index.to_numpy()] = row_errors.to_numpy()
+        return messages
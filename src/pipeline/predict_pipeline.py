@@ -1,6 +1,14 @@
 import os
-import mlflow
-from src.utils import load_object, load_json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import numpy as np
+import pandas as pd
+import hashlib
+from src.utils import load_object, load_json, load_sklearn_model, load_model_metadata, resolve_n_jobs
+from src.instrumentation import LatencyHistogram
+from src.pipeline.prediction_cache import PredictionCache
+from src.pipeline.input_schema import InputSchema
 from dataclasses import dataclass
 
 from src.logger import logging
@@ -10,45 +18,384 @@ from src.exception import CustomException
 @dataclass
 class InferenceConfig:
     preprocessor_path: str = os.path.join("artifacts", "preprocessor.pkl")
+    compiled_preprocessor_path: str = os.path.join("artifacts", "compiled_preprocessor.pkl")
+    use_compiled_preprocessor: bool = False
     model_path: str = os.path.join("artifacts", "best_model")
+    compiled_model_path: str = os.path.join("artifacts", "compiled_model.pkl")
+    # score with the CompiledTreeEnsemble exported next to a tree ensemble best model, same
+    # probabilities with less per-call overhead on small batches ; falls back to the best model
+    use_compiled_model: bool = False
     class_labels_path: str = os.path.join("data", "encoded", "class_encodings.json")
-    
+    column_values_path: str = os.path.join("data", "encoded", "column_unique_values.json")
+    # convert batches to the typed InputSchema before scoring ; rows with invalid values are
+    # not scored and get their errors in an `input_errors` column instead of failing the batch
+    validate_input: bool = False
+    batch_chunk_size: int = 100_000
+    n_jobs: int = 1
+    # keep a histogram of predict_churn call latencies in ChurnInference.latency_histogram
+    record_latency: bool = False
+    # rows kept in the in-memory prediction cache, 0 disables the cache
+    prediction_cache_size: int = 0
+    # optional sqlite file holding the cached predictions, shared between processes
+    prediction_cache_path: str = None
+    # drop the rows of other models from that file when the cache is opened ; leave off while
+    # processes of the previous model may still share it, e.g. during a rolling deploy
+    prediction_cache_drop_other_models: bool = False
+    # default result of predict_churn, one of OUTPUT_MODES, see ChurnInference.predict_churn
+    output_mode: str = "inplace"
+
+
+OUTPUT_MODES = ("inplace", "arrays", "join")
+
+
+@dataclass
+class ChurnPredictions:
+    """
+    Predictions of a batch as compact arrays aligned with its rows : int8 indices in
+    `class_names` (-1 for the rows that were not scored) and float32 confidences, plus
+    the per-row `input_errors` messages when the input was validated.
+    """
+    label_codes: np.ndarray
+    confidences: np.ndarray
+    class_names: np.ndarray
+    input_errors: np.ndarray = None
+
+    def __len__(self):
+        return len(self.label_codes)
+
+    @property
+    def labels(self):
+        return pd.Categorical.from_codes(self.label_codes, categories=self.class_names)
+
+    def get_columns(self, compact=True):
+        """
+        Output columns by name. `compact` keeps the categorical labels and float32
+        confidences ; otherwise they are the label strings (None when not scored) and
+        float64 confidences that predict_churn has always returned.
+        """
+        if compact:
+            columns = {"predicted_churn": self.labels, "prediction_confidence": self.confidences}
+        else:
+            labels = np.asarray(self.class_names, dtype=object)[self.label_codes]
+            labels[self.label_codes < 0] = None
+            columns = {"predicted_churn": labels, "prediction_confidence": self.confidences.astype(np.float64).round(2)}
+        if self.input_errors is not None:
+            columns["input_errors"] = self.input_errors
+        return columns
+
+    @classmethod
+    def concat(cls, predictions):
+        return cls(label_codes=np.concatenate([p.label_codes for p in predictions]),
+                   confidences=np.concatenate([p.confidences for p in predictions]),
+                   class_names=predictions[0].class_names,
+                   input_errors=None if predictions[0].input_errors is None
+                   else np.concatenate([p.input_errors for p in predictions]))
+
+
 class ChurnInference:
-    def __init__(self):
+    def __init__(self, inference_config=None):
         try:
-            self.inference_config = InferenceConfig()
-            self.preprocessor = load_object(self.inference_config.preprocessor_path)
-            self.model = mlflow.sklearn.load_model(self.inference_config.model_path)
+            self.inference_config = inference_config or InferenceConfig()
+            if self.inference_config.use_compiled_preprocessor:
+                self.preprocessor = load_object(self.inference_config.compiled_preprocessor_path)
+            else:
+                self.preprocessor = load_object(self.inference_config.preprocessor_path)
+            self.model = self.load_model()
             self.class_labels = load_json(self.inference_config.class_labels_path)
+
+            # label names ordered like the columns of predict_proba
+            enc_to_class = {v:k for k,v in self.class_labels.items()}
+            self.class_names = np.array([enc_to_class[c] for c in self.model.classes_], dtype=object)
+            self.input_schema = None
+            if self.inference_config.validate_input:
+                self.input_schema = InputSchema.from_preprocessor(self.preprocessor,
+                                                                  load_json(self.inference_config.column_values_path))
+            self.latency_histogram = LatencyHistogram() if self.inference_config.record_latency else None
+            self.prediction_cache = None
+            if self.inference_config.prediction_cache_size > 0:
+                self.prediction_cache = self.get_prediction_cache()
             logging.info("preprocessor and model objects are loaded.")
         
         except Exception as e:
             raise CustomException(e)
         
         
-    def predict_churn(self, df):
+    def load_model(self):
+        compiled_model_path = self.inference_config.compiled_model_path
+        if self.inference_config.use_compiled_model:
+            if not os.path.exists(compiled_model_path):
+                logging.info(f"no compiled model at {compiled_model_path}, using the best model")
+            else:
+                compiled_model = load_object(compiled_model_path)
+                if compiled_model.source_model_uuid == self.get_model_uuid():
+                    logging.info(f"compiled model loaded from {compiled_model_path}")
+                    return compiled_model
+                logging.info(f"compiled model at {compiled_model_path} was built from another best model, using the best model")
+        return load_sklearn_model(self.inference_config.model_path)
+
+
+    def get_model_uuid(self):
+        """UUID recorded in the MLmodel file, or else a hash of the model files, identifying the loaded model."""
+        model_uuid = load_model_metadata(self.inference_config.model_path).get("model_uuid")
+        if model_uuid:
+            return str(model_uuid)
+        model_hash = hashlib.sha256()
+        for file_name in sorted(os.listdir(self.inference_config.model_path)):
+            with open(os.path.join(self.inference_config.model_path, file_name), "rb") as f:
+                model_hash.update(f.read())
+        return model_hash.hexdigest()
+
+    def get_input_cols(self):
+        """Raw columns the preprocessor reads from an input batch."""
+        if hasattr(self.preprocessor, "named_transformers_"):
+            return list(self.preprocessor.feature_names_in_)
+        return self.preprocessor.numeric_cols + self.preprocessor.categorical_cols
+
+    def get_prediction_cache(self):
+        if hasattr(self.preprocessor, "named_transformers_"):
+            numeric_cols = list(self.preprocessor.named_transformers_["numerical_pipeline"].feature_names_in_)
+        else:
+            numeric_cols = self.preprocessor.numeric_cols
+
+        return PredictionCache(model_uuid=self.get_model_uuid(),
+                               input_cols=self.get_input_cols(),
+                               numeric_cols=numeric_cols,
+                               max_entries=self.inference_config.prediction_cache_size,
+                               disk_path=self.inference_config.prediction_cache_path,
+                               drop_other_models=self.inference_config.prediction_cache_drop_other_models)
+
+
+    def score(self, df):
+        """Indices in `class_names` of the predicted labels and their confidences, aligned with the rows of `df`."""
+        processed_df = self.preprocessor.transform(df)
+        logging.info("data processed ...")
+        prediction_confs = self.model.predict_proba(processed_df)
+        logging.info("prediction complete ...")
+
+        # labels and confidences from the same probability pass
+        predicted_idx = prediction_confs.argmax(axis=1)
+        return (predicted_idx.astype(np.int8),
+                np.round(prediction_confs[np.arange(len(predicted_idx)), predicted_idx], 2))
+
+
+    def score_with_cache(self, df):
+        """Same as `score`, only the rows missing from the prediction cache go through the model."""
+        keys = self.prediction_cache.get_keys(df)
+        labels, confidences, found = self.prediction_cache.lookup(keys)
+        if not found.all():
+            missing = np.flatnonzero(~found)
+            label_codes, confidences[missing] = self.score(df.iloc[missing])
+            labels[missing] = self.class_names[label_codes]
+            self.prediction_cache.store(keys[missing], labels[missing], confidences[missing])
+        logging.info(f"{int(found.sum())} of {len(df)} predictions served from the cache ...")
+        return pd.Index(self.class_names).get_indexer(labels).astype(np.int8), confidences
+
+
+    def get_predictions(self, df):
+        """ChurnPredictions of `df`, validated and cached as configured ; `df` is not modified."""
+        start = time.perf_counter()
+        n_rows = len(df)
+        label_codes = np.full(n_rows, -1, dtype=np.int8)
+        confidences = np.full(n_rows, np.nan, dtype=np.float32)
+        score = self.score_with_cache if self.prediction_cache is not None else self.score
+
+        input_errors = None
+        if self.input_schema is not None:
+            typed_df, errors = self.input_schema.validate(df)
+            valid = np.ones(n_rows, dtype=bool)
+            valid[errors["row"].to_numpy(dtype=np.int64)] = False
+            if len(errors):
+                logging.info(f"{n_rows - int(valid.sum())} of {n_rows} rows failed the input validation ...")
+            if valid.all():
+                label_codes[:], confidences[:] = score(typed_df)
+            elif valid.any():
+                label_codes[valid], confidences[valid] = score(typed_df[valid])
+            input_errors = InputSchema.get_row_messages(errors, n_rows)
+        elif n_rows:
+            label_codes[:], confidences[:] = score(df)
+
+        if self.latency_histogram is not None:
+            self.latency_histogram.observe(time.perf_counter() - start, rows=n_rows)
+        return ChurnPredictions(label_codes, confidences, self.class_names, input_errors)
+
+
+    def format_predictions(self, df, predictions, output_mode):
+        if output_mode == "arrays":
+            return predictions
+        if output_mode == "join":
+            # a shallow copy shares the column data of `df`, the caller's frame gets no new columns
+            df = df.copy(deep=False)
+        for col, values in predictions.get_columns(compact=output_mode == "join").items():
+            df[col] = values
+        return df
+
+
+    def predict_churn(self, df, output_mode=None):
+        """
+        Scores `df` ; `output_mode` (InferenceConfig.output_mode by default) picks the result :
+        "inplace" adds the prediction columns to `df` itself and returns it, "arrays" only
+        returns the ChurnPredictions, "join" returns a shallow copy of `df` with the compact
+        prediction columns added, leaving `df` untouched without duplicating its data.
+        """
         try:
-            processed_df = self.preprocessor.transform(df)
-            logging.info("data processed ...")
-            predictions = self.model.predict(processed_df)
-            prediction_confs = self.model.predict_proba(processed_df)
-            logging.info("prediction complete ...")
-            enc_to_class = {v:k for k,v in self.class_labels.items()}
-            df["predicted_churn"] = [enc_to_class[c] for c in predictions]
-            confs_mod = []
-            for i,c in enumerate(predictions):
-                confs_mod.append(round(prediction_confs[i,c],2))
-                 
-            df["prediction_confidence"] = confs_mod
-            
-            return df
+            output_mode = output_mode or self.inference_config.output_mode
+            if output_mode not in OUTPUT_MODES:
+                raise ValueError(f"unknown output mode {output_mode}, expected one of {OUTPUT_MODES}")
+            return self.format_predictions(df, self.get_predictions(df), output_mode)
         
         except Exception as e:
             raise CustomException(e)
-    
+
+
+    def predict_churn_in_chunks(self, input_path, output_path, chunk_size=None, n_jobs=None):
+        """
+        Streams `input_path` (csv or parquet) through the preprocessor and model
+        `chunk_size` rows at a time and appends the predictions to `output_path`
+        (csv, or parquet when the path ends with .parquet), so that only a few chunks
+        are held in memory. With `n_jobs` > 1 the chunks are scored on a process pool
+        while the output keeps the input row order. Returns the number of rows scored.
+        """
+        try:
+            chunk_size = chunk_size or self.inference_config.batch_chunk_size
+            n_jobs = resolve_n_jobs(n_jobs or self.inference_config.n_jobs)
+            writer = PredictionWriter(output_path)
+            n_rows = 0
+            try:
+                for chunk, predictions in self.iter_chunk_predictions(iter_input_chunks(input_path, chunk_size), n_jobs):
+                    writer.write(chunk, predictions)
+                    n_rows += len(chunk)
+                    logging.info(f"scored {n_rows} rows from {input_path} ...")
+            finally:
+                writer.close()
+
+            logging.info(f"batch scoring done; {n_rows} predictions saved at {output_path}")
+            return n_rows
+
+        except Exception as e:
+            raise CustomException(e)
+
+
+    def iter_chunk_predictions(self, chunks, n_jobs=1):
+        """Yields every chunk with its ChurnPredictions ; workers only send the prediction arrays back."""
+        if n_jobs == 1:
+            for chunk in chunks:
+                yield chunk, self.get_predictions(chunk)
+            return
+
+        with self.get_worker_pool(n_jobs) as pool:
+            # at most 2 chunks per worker are in flight, results are consumed in submission order
+            pending = deque()
+            for chunk in chunks:
+                pending.append((chunk, pool.submit(_score_in_worker, chunk)))
+                if len(pending) >= 2 * n_jobs:
+                    chunk, future = pending.popleft()
+                    yield chunk, future.result()
+            while pending:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+
+
+    def predict_churn_parallel(self, df, n_jobs=None, output_mode=None):
+        """
+        Shards an in-memory dataframe across a process pool and returns the predictions
+        in input order; the result is identical to `predict_churn(df, output_mode)`.
+        """
+        try:
+            n_jobs = resolve_n_jobs(n_jobs or self.inference_config.n_jobs)
+            if n_jobs == 1 or len(df) < 2 * n_jobs:
+                return self.predict_churn(df, output_mode)
+
+            output_mode = output_mode or self.inference_config.output_mode
+            if output_mode not in OUTPUT_MODES:
+                raise ValueError(f"unknown output mode {output_mode}, expected one of {OUTPUT_MODES}")
+            shard_bounds = np.linspace(0, len(df), n_jobs + 1).astype(int)
+            shards = [df.iloc[start:end] for start, end in zip(shard_bounds[:-1], shard_bounds[1:])]
+            with self.get_worker_pool(n_jobs) as pool:
+                predictions = ChurnPredictions.concat(list(pool.map(_score_in_worker, shards)))
+            logging.info(f"scored {len(df)} rows on {n_jobs} processes ...")
+
+            return self.format_predictions(df, predictions, output_mode)
+
+        except Exception as e:
+            raise CustomException(e)
+
+
+    def get_worker_pool(self, n_jobs):
+        # every worker loads the preprocessor and model once, in _init_worker
+        return ProcessPoolExecutor(max_workers=n_jobs,
+                                   initializer=_init_worker,
+                                   initargs=(self.inference_config,))
+
+
+_worker_inference = None
+
+def _init_worker(inference_config):
+    global _worker_inference
+    _worker_inference = ChurnInference(inference_config)
+
+
+def _score_in_worker(df):
+    return _worker_inference.get_predictions(df)
+
+
+def iter_input_chunks(input_path, chunk_size):
+    if input_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(input_path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(input_path, chunksize=chunk_size):
+            yield chunk
+
+
+class PredictionWriter:
+    """Appends scored chunks to a csv or parquet file, writing the header / schema once."""
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.is_parquet = output_path.endswith(".parquet")
+        self.parquet_writer = None
+        self.header_written = False
+
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, df, predictions=None):
+        """Appends `df`, followed by the columns of `predictions` when given, without joining them in memory."""
+        if self.is_parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            # pinned, a chunk whose errors or labels are all None would otherwise type them as null
+            # and the later chunks could not be cast to the schema of the first one
+            prediction_types = {"predicted_churn": pa.string(), "prediction_confidence": pa.float64(), "input_errors": pa.string()}
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if predictions is not None:
+                for col, values in predictions.get_columns(compact=False).items():
+                    table = table.append_column(col, pa.array(values, type=prediction_types[col], from_pandas=True))
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.output_path, table.schema)
+            else:
+                table = table.cast(self.parquet_writer.schema)
+            self.parquet_writer.write_table(table)
+        else:
+            if predictions is not None:
+                df = df.copy(deep=False)
+                for col, values in predictions.get_columns(compact=False).items():
+                    df[col] = values
+            df.to_csv(self.output_path, mode="a" if self.header_written else "w",
+                      header=not self.header_written, index=False)
+        self.header_written = True
+
+    def close(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+            self.parquet_writer = None
+
 
 if __name__ == "__main__":
-    import pandas as pd
     df = pd.read_csv(os.path.join("data", "intermediate", "test_x.csv"))
     
     churn_pred_model = ChurnInference()
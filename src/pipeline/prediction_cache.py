@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from src.logger import logging
+
+
+class PredictionCache:
+    """
+    Cache of (predicted_churn, prediction_confidence) per customer feature row.
+
+    Rows are keyed by a 64-bit hash of their canonicalized features (`input_cols` sorted
+    by name, numeric values as float64, the others as strings), seeded with the model
+    UUID so that keys of different models never meet. The memory tier is an LRU bounded to
+    `max_entries` rows; the optional sqlite tier at `disk_path` is shared by every process
+    using the same file, whatever model they serve, so that processes of the old and the new
+    model can run side by side during a deploy. The rows of other models are only dropped on
+    request, with `drop_other_models` (or `drop_other_models=True` once no process serves them).
+    """
+    def __init__(self, model_uuid, input_cols, numeric_cols, max_entries=100_000, disk_path=None, drop_other_models=False):
+        self.model_uuid = str(model_uuid)
+        self.input_cols = sorted(input_cols)
+        self.numeric_cols = set(numeric_cols)
+        # hash_pandas_object takes a 16 character key
+        self.hash_key = (self.model_uuid + "0" * 16)[:16]
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.disk_path = disk_path
+        if disk_path is not None:
+            self.init_disk_tier()
+            if drop_other_models:
+                self.drop_other_models()
+
+    def init_disk_tier(self):
+        disk_dir = os.path.dirname(self.disk_path)
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        with self.connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "model_uuid TEXT NOT NULL, row_hash INTEGER NOT NULL, "
+                "predicted_churn TEXT NOT NULL, prediction_confidence REAL NOT NULL, "
+                "PRIMARY KEY (model_uuid, row_hash)) WITHOUT ROWID"
+            )
+
+    def drop_other_models(self):
+        """Deletes the disk rows of every model but this one ; only safe once no process serves those models anymore."""
+        if self.disk_path is None:
+            return 0
+        with self.connect() as connection:
+            stale_rows = connection.execute("DELETE FROM predictions WHERE model_uuid != ?", (self.model_uuid,)).rowcount
+        logging.info(f"dropped {stale_rows} cached predictions of other models from {self.disk_path}")
+        return stale_rows
+
+    @contextmanager
+    def connect(self):
+        # one short-lived connection per call, so the cache can be used from several threads
+        connection = sqlite3.connect(self.disk_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get_keys(self, df):
+        # columns are hashed one by one and mixed, building a canonical DataFrame for
+        # hash_pandas_object costs milliseconds, which is more than scoring a single row
+        keys = np.zeros(len(df), dtype=np.uint64)
+        for col in self.input_cols:
+            values = df[col].to_numpy()
+            if col in self.numeric_cols:
+                values = values.astype(np.float64)
+            else:
+                values = values.astype(str).astype(object)
+            keys = keys * np.uint64(1000003) ^ pd.util.hash_array(values, hash_key=self.hash_key, categorize=False)
+        # signed, so that the keys fit sqlite integers
+        return keys.view(np.int64)
+
+    def lookup(self, keys):
+        """Returns the cached labels, confidences and a mask of the keys that were found."""
+        n_rows = len(keys)
+        labels = np.empty(n_rows, dtype=object)
+        confidences = np.empty(n_rows, dtype=np.float64)
+        found = np.zeros(n_rows, dtype=bool)
+
+        with self.lock:
+            for i, key in enumerate(keys.tolist()):
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    labels[i], confidences[i] = entry
+                    found[i] = True
+
+        if self.disk_path is not None and not found.all():
+            missing = np.flatnonzero(~found)
+            disk_entries = self.read_disk(keys[missing].tolist())
+            disk_found = []
+            for i in missing:
+                entry = disk_entries.get(int(keys[i]))
+                if entry is not None:
+                    labels[i], confidences[i] = entry
+                    found[i] = True
+                    disk_found.append(i)
+            # disk hits are promoted to the memory tier
+            self.store_in_memory(keys[disk_found], labels[disk_found], confidences[disk_found])
+
+        with self.lock:
+            self.hits += int(found.sum())
+            self.misses += int(n_rows - found.sum())
+        return labels, confidences, found
+
+    def read_disk(self, keys, batch_size=500):
+        entries = {}
+        with self.connect() as connection:
+            for start in range(0, len(keys), batch_size):
+                batch = keys[start:start + batch_size]
+                rows = connection.execute(
+                    "SELECT row_hash, predicted_churn, prediction_confidence FROM predictions "
+                    f"WHERE model_uuid = ? AND row_hash IN ({','.join('?' * len(batch))})",
+                    (self.model_uuid, *batch)
+                )
+                entries.update((row_hash, (label, confidence)) for row_hash, label, confidence in rows)
+        return entries
+
+    def store_in_memory(self, keys, labels, confidences):
+        with self.lock:
+            for key, label, confidence in zip(keys.tolist(), labels, confidences.tolist()):
+                self.entries[key] = (label, confidence)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def store(self, keys, labels, confidences):
+        self.store_in_memory(keys, labels, confidences)
+        if self.disk_path is not None:
+            with self.connect() as connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)",
+                    zip([self.model_uuid] * len(keys), keys.tolist(), labels.tolist(), confidences.tolist())
+                )
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.disk_path is not None:
+            with self.connect() as connection:
+                connection.execute("DELETE FROM predictions WHERE model_uuid = ?", (self.model_uuid,))
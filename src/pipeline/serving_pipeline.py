@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from src.pipeline.predict_pipeline import ChurnInference
+from src.logger import logging
+from src.exception import CustomException
+
+
+@dataclass
+class ServingConfig:
+    host: str = os.environ.get("CHURN_SERVING_HOST", "0.0.0.0")
+    port: int = int(os.environ.get("CHURN_SERVING_PORT", 8000))
+    max_batch_size: int = 256
+    max_wait_ms: float = 2.0
+    request_timeout_s: float = 5.0
+
+
+class MicroBatcher:
+    """
+    Collects concurrent single-row requests for at most `max_wait_ms` (or until
+    `max_batch_size` rows are queued) and scores them with one predict_churn call.
+    """
+    def __init__(self, inference, max_batch_size=256, max_wait_ms=2.0):
+        self.inference = inference
+        self.input_cols = inference.get_input_cols()
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.is_running = True
+        self.worker = threading.Thread(target=self.run, name="churn-micro-batcher", daemon=True)
+        self.worker.start()
+
+    def submit(self, record):
+        future = Future()
+        self.requests.put((record, future))
+        return future
+
+    def run(self):
+        while self.is_running:
+            try:
+                batch = [self.requests.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+
+            deadline = time.perf_counter() + self.max_wait_s
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self.score_batch(batch)
+
+    def score_batch(self, batch):
+        records = [record for record, _ in batch]
+        futures = [future for _, future in batch]
+        try:
+            for future, prediction in zip(futures, self.predict_records(records)):
+                future.set_result(prediction)
+        except Exception:
+            # one malformed record must not fail the other callers of the batch
+            for record, future in batch:
+                try:
+                    future.set_result(self.predict_records([record])[0])
+                except Exception as e:
+                    future.set_exception(e)
+
+    def predict_records(self, records):
+        """
+        One prediction (or {"error": ...}) per record. Records missing input columns are
+        rejected before the batch is built, otherwise the DataFrame would fill their gaps
+        with NaN from the other records and the preprocessor would impute them, so that
+        the answer to a record would depend on the batch it lands in.
+        """
+        errors = [self.get_record_error(record) for record in records]
+        valid_records = [record for record, error in zip(records, errors) if error is None]
+        predictions = iter(self.score_records(valid_records) if valid_records else [])
+        return [next(predictions) if error is None else {"error": error} for error in errors]
+
+    def get_record_error(self, record):
+        if not isinstance(record, dict):
+            return "expected a json object with one customer's features"
+        missing_cols = [col for col in self.input_cols if col not in record]
+        if missing_cols:
+            return f"input is missing the columns {missing_cols}"
+        return None
+
+    def score_records(self, records):
+        # arrays whatever InferenceConfig.output_mode is, the response is built from them
+        predictions = self.inference.predict_churn(pd.DataFrame.from_records(records), output_mode="arrays")
+        columns = predictions.get_columns(compact=False)
+        # only present with InferenceConfig.validate_input, invalid records get their errors instead of a prediction
+        input_errors = columns.get("input_errors", [None] * len(predictions))
+        return [
+            {"predicted_churn": label, "prediction_confidence": float(conf)} if error is None else {"error": error}
+            for label, conf, error in zip(columns["predicted_churn"], columns["prediction_confidence"], input_errors)
+        ]
+
+    def stop(self):
+        self.is_running = False
+        self.worker.join()
+
+
+class ChurnRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "ChurnScoring/0.1"
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        elif self.path == "/metrics":
+            latency_histogram = self.server.batcher.inference.latency_histogram
+            if latency_histogram is None:
+                self.send_json(404, {"error": "latency recording is disabled, set InferenceConfig.record_latency"})
+            else:
+                self.send_json(200, {"predict_churn_latency": latency_histogram.summary()})
+        else:
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"null")
+        except ValueError as e:
+            self.send_json(400, {"error": f"invalid json body : {e}"})
+            return
+
+        try:
+            if self.path == "/predict":
+                if not isinstance(payload, dict):
+                    self.send_json(400, {"error": "expected a json object with one customer's features"})
+                    return
+                future = self.server.batcher.submit(payload)
+                prediction = future.result(timeout=self.server.serving_config.request_timeout_s)
+                self.send_json(422 if "error" in prediction else 200, prediction)
+
+            elif self.path == "/predict/batch":
+                records = payload.get("records") if isinstance(payload, dict) else payload
+                if not isinstance(records, list):
+                    self.send_json(400, {"error": "expected a json list of customers or {\"records\": [...]}"})
+                    return
+                predictions = self.server.batcher.predict_records(records) if records else []
+                self.send_json(200, {"predictions": predictions})
+
+            else:
+                self.send_json(404, {"error": f"unknown path {self.path}"})
+
+        except Exception as e:
+            logging.info(f"prediction request failed : {e}")
+            self.send_json(422, {"error": str(e)})
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # per-request access logs would dominate the latency budget
+        pass
+
+
+class ChurnServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, serving_config=None, inference=None):
+        try:
+            self.serving_config = serving_config or ServingConfig()
+            inference = inference or ChurnInference()
+            self.batcher = MicroBatcher(inference,
+                                        max_batch_size=self.serving_config.max_batch_size,
+                                        max_wait_ms=self.serving_config.max_wait_ms)
+            super().__init__((self.serving_config.host, self.serving_config.port), ChurnRequestHandler)
+            logging.info(f"churn scoring service listening on {self.serving_config.host}:{self.serving_config.port}")
+
+        except Exception as e:
+            raise CustomException(e)
+
+    def server_close(self):
+        self.batcher.stop()
+        super().server_close()
+
+
+if __name__ == "__main__":
+    server = ChurnServer()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
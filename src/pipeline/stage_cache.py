@@ -0,0 +1,95 @@
+import os
+import json
+import hashlib
+import inspect
+import importlib
+from dataclasses import dataclass, asdict, is_dataclass
+
+from src.logger import logging
+from src.exception import CustomException
+
+
+@dataclass
+class StageCacheConfig:
+    manifest_dir: str = os.path.join("artifacts", "stage_cache")
+    hash_block_size: int = 1 << 20
+    # modules every stage depends on besides its own, src.utils holds the artifact I/O helpers
+    shared_code_modules: tuple = ("src.utils",)
+
+
+class StageCache:
+    """
+    Skips a pipeline stage when the fingerprint of its input files, parameters and
+    source code (the modules defining `code_objects`, plus the shared modules of
+    StageCacheConfig) matches the one recorded the last time it ran, and its
+    recorded output files are still in place.
+    """
+    def __init__(self, enabled=True):
+        self.stage_cache_config = StageCacheConfig()
+        self.enabled = enabled
+
+    def hash_file(self, file_path):
+        file_hash = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(self.stage_cache_config.hash_block_size), b""):
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+    def fingerprint(self, input_paths, params, code_objects):
+        if is_dataclass(params):
+            params = asdict(params)
+        stage_state = {
+            "inputs": {path: self.hash_file(path) for path in input_paths},
+            "params": params,
+            "code": [hashlib.sha256(inspect.getsource(module).encode("utf-8")).hexdigest()
+                     for module in self.get_code_modules(code_objects)]
+        }
+        return hashlib.sha256(json.dumps(stage_state, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get_code_modules(self, code_objects):
+        modules = [inspect.getmodule(obj) for obj in code_objects]
+        modules += [importlib.import_module(name) for name in self.stage_cache_config.shared_code_modules]
+        # a module listed twice is hashed once
+        return list(dict.fromkeys(modules))
+
+    def output_state(self, output_paths):
+        return {path: [os.path.getsize(path), os.path.getmtime(path)] for path in output_paths}
+
+    def manifest_path(self, stage_name):
+        return os.path.join(self.stage_cache_config.manifest_dir, f"{stage_name}.json")
+
+    def is_fresh(self, stage_name, fingerprint, output_paths):
+        manifest_path = self.manifest_path(stage_name)
+        if not self.enabled or not os.path.exists(manifest_path):
+            return False
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if manifest["fingerprint"] != fingerprint:
+            return False
+        if not all(os.path.exists(path) for path in output_paths):
+            return False
+        return manifest["outputs"] == self.output_state(output_paths)
+
+    def record(self, stage_name, fingerprint, output_paths):
+        os.makedirs(self.stage_cache_config.manifest_dir, exist_ok=True)
+        with open(self.manifest_path(stage_name), "w") as f:
+            json.dump({"fingerprint": fingerprint, "outputs": self.output_state(output_paths)}, f, indent=2)
+
+    def run(self, stage_name, run_stage, load_stage, input_paths, params, code_objects, output_paths):
+        """
+        Returns `load_stage()` when the stage is up to date, otherwise `run_stage()`,
+        recording the new fingerprint once the stage has written its outputs.
+        """
+        try:
+            fingerprint = self.fingerprint(input_paths, params, code_objects)
+            if self.is_fresh(stage_name, fingerprint, output_paths):
+                logging.info(f"{stage_name} is up to date (fingerprint {fingerprint[:12]}), reloading its artifacts ...")
+                return load_stage()
+
+            result = run_stage()
+            if self.enabled:
+                self.record(stage_name, fingerprint, output_paths)
+            return result
+
+        except Exception as e:
+            raise CustomException(e)
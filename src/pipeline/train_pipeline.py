@@ -1,24 +1,105 @@
+import sys
+
 from src.components.data_ingestion import DataIngestion
-from src.components.data_transformation import DataTransformation
+from src.components.data_transformation import DataTransformation, get_scaler_params
 from src.components.data_augmentation import DataAugmentation
 from src.components.model_trainer import ModelTrainer
+from src.components.compiled_preprocessor import CompiledPreprocessor
+from src.pipeline.stage_cache import StageCache
+from src.instrumentation import StageTimer, log_stage_metrics
+from src.utils import LazyArray, load_object
+
+
+# stages whose inputs, configs and code are unchanged since their last run are reloaded from disk;
+# pass --no-cache to force every stage to run
+stage_cache = StageCache(enabled="--no-cache" not in sys.argv)
+
+# pass --mmap to hand the datasets to the trainer as memory-mapped handles on the saved files,
+# so that only the dataset being trained is resident
+mmap_datasets = "--mmap" in sys.argv
+
+# pass --async-logging to write the MLflow runs of the models from a background thread while training goes on
+async_logging = "--async-logging" in sys.argv
+
+# pass --successive-halving to select the model on growing subsamples instead of fully fitting the whole grid
+successive_halving = "--successive-halving" in sys.argv
+
+# pass --approximate-svc to replace the exact RBF SVC candidate with its linear-time Nystroem approximation
+approximate_svc = "--approximate-svc" in sys.argv
+
+# wall / cpu time, peak RSS and rows per second of every stage, logged to MLflow once the models are trained
+stage_timers = []
 
 
 # data ingestion - loading and splitting data 
 data_inj = DataIngestion()
-train_x_path, train_y_path, test_x_path, test_y_path = data_inj.ingest_data()
+with StageTimer("data_ingestion") as timer:
+    train_x_path, train_y_path, test_x_path, test_y_path = stage_cache.run(
+        "data_ingestion",
+        run_stage=data_inj.ingest_data,
+        load_stage=lambda: (data_inj.data_configs.train_x_data_path,
+                            data_inj.data_configs.train_y_data_path,
+                            data_inj.data_configs.test_x_data_path,
+                            data_inj.data_configs.test_y_data_path),
+        input_paths=data_inj.get_raw_data_paths(),
+        params=data_inj.data_configs,
+        code_objects=[DataIngestion],
+        output_paths=data_inj.get_artifact_paths()
+    )
+    if hasattr(data_inj, "cleaning_report"):
+        timer.rows = data_inj.cleaning_report["rows_in"]
+stage_timers.append(timer)
 
 
 # data transformation - transforming data (Scaling, One-hot-encoding)
 data_transformation = DataTransformation()
-train_x_enc, train_y_enc, test_x_enc, test_y_enc, preprocessor_path = data_transformation.transform_data(train_x_path,
-                                                                                                        train_y_path,
-                                                                                                        test_x_path,
-                                                                                                        test_y_path)
+with StageTimer("data_transformation") as timer:
+    train_x_enc, train_y_enc, test_x_enc, test_y_enc, preprocessor_path = stage_cache.run(
+        "data_transformation",
+        run_stage=lambda: data_transformation.transform_data(train_x_path,
+                                                             train_y_path,
+                                                             test_x_path,
+                                                             test_y_path),
+        load_stage=data_transformation.load_transformed_data,
+        input_paths=[train_x_path, train_y_path, test_x_path, test_y_path],
+        params=data_transformation.data_transform_configs,
+        code_objects=[DataTransformation, CompiledPreprocessor],
+        output_paths=data_transformation.get_artifact_paths()
+    )
+    timer.rows = train_y_enc.shape[0] + test_y_enc.shape[0]
+stage_timers.append(timer)
+
+transform_configs = data_transformation.data_transform_configs
+if mmap_datasets:
+    train_x_enc = LazyArray(transform_configs.train_x_data_enc_path)
+    train_y_enc = LazyArray(transform_configs.train_y_data_enc_path)
+    test_x_enc = LazyArray(transform_configs.test_x_data_enc_path)
+    test_y_enc = LazyArray(transform_configs.test_y_data_enc_path)
+
 # data augmentation - augmentation to tackle imbalance in the data (Undersampling, Oversampling, SMOTE)
+# strategies are resampled (or reloaded from the stage cache) one at a time, when the trainer reaches them
 data_augmentation = DataAugmentation()
-augmented_data_list = data_augmentation.augment_data(train_x_enc, train_y_enc)
+augmented_data_list = data_augmentation.iter_augmented_data(
+    train_x_enc,
+    train_y_enc,
+    is_sparse=transform_configs.sparse_output,
+    stage_cache=stage_cache,
+    input_paths=[transform_configs.train_x_data_enc_path, transform_configs.train_y_data_enc_path],
+    lazy=mmap_datasets
+)
 
 # model training - Selecting the best model with experiment tracking using MLflow
+# (its time includes the augmentation of the strategies it consumes, also reported on their own)
 model_trainer = ModelTrainer()
-best_model = model_trainer.train_and_evaluate_model(augmented_data_list, test_x_enc, test_y_enc)
\ No newline at end of file
+model_trainer.model_trainer_config.async_logging = async_logging
+if successive_halving:
+    model_trainer.model_trainer_config.selection_mode = "successive_halving"
+if approximate_svc:
+    model_trainer.model_trainer_config.svc_mode = "approximate"
+with StageTimer("model_training") as timer:
+    # incremental training re-expresses a continued run on the scaler state it was fitted on
+    best_model = model_trainer.train_and_evaluate_model(augmented_data_list, test_x_enc, test_y_enc,
+                                                        run_params=get_scaler_params(load_object(preprocessor_path)))
+stage_timers.append(timer)
+
+log_stage_metrics(stage_timers + data_augmentation.stage_timers)
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import queue
+import tempfile
+import threading
+
+from src.logger import logging
+from src.exception import CustomException
+
+
+class AsyncRunLogger:
+    """
+    Background writer for MLflow runs. `log_run` only queues the run's params, metrics
+    and model; a worker thread creates the run, sends params and metrics with one
+    log_batch call, saves the model to a temporary directory, uploads it with
+    log_artifacts and terminates the run. `close` waits for every queued run. The saved
+    model carries the run_id and the run the log-model history tag, like the runs of
+    mlflow.sklearn.log_model, so the UI lists it.
+
+    MLflow infers the pip requirements of a saved model in a subprocess, which takes
+    seconds; they are inferred once per model class and reused for its later runs.
+    """
+    def __init__(self, tracking_uri, experiment_id):
+        from mlflow import MlflowClient
+
+        self.client = MlflowClient(tracking_uri=tracking_uri)
+        self.experiment_id = experiment_id
+        self.pending_runs = queue.Queue()
+        self.errors = []
+        self.pip_requirements = {}
+        self.worker = threading.Thread(target=self.run, name="mlflow-async-logger", daemon=True)
+        self.worker.start()
+
+    def log_run(self, run_name, params, metrics, model=None, artifact_path="model"):
+        """Queues one run; `model` must not be modified afterwards, it is pickled later by the worker."""
+        self.pending_runs.put((run_name, params, metrics, model, artifact_path, int(time.time() * 1000)))
+
+    def run(self):
+        while True:
+            pending_run = self.pending_runs.get()
+            try:
+                if pending_run is None:
+                    return
+                self.write_run(*pending_run)
+            except Exception as e:
+                logging.info(f"async mlflow logging of run {pending_run[0]} failed : {e}")
+                self.errors.append(e)
+            finally:
+                self.pending_runs.task_done()
+
+    def write_run(self, run_name, params, metrics, model, artifact_path, timestamp):
+        from mlflow.entities import Metric, Param, RunStatus
+        from mlflow.utils.mlflow_tags import MLFLOW_LOGGED_MODELS
+
+        run_id = self.client.create_run(self.experiment_id, start_time=timestamp, run_name=run_name).info.run_id
+        try:
+            self.client.log_batch(
+                run_id,
+                metrics=[Metric(name, float(value), timestamp, 0) for name, value in metrics.items()],
+                params=[Param(name, str(value)) for name, value in params.items()]
+            )
+            if model is not None:
+                import mlflow.sklearn
+                from mlflow.models import Model
+
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    model_dir = os.path.join(tmp_dir, artifact_path)
+                    model_class = type(model).__qualname__
+                    # run_id and artifact_path end up in the MLmodel file, as with log_model
+                    mlflow_model = Model(artifact_path=artifact_path, run_id=run_id)
+                    mlflow.sklearn.save_model(model, model_dir, mlflow_model=mlflow_model,
+                                              pip_requirements=self.pip_requirements.get(model_class))
+                    if model_class not in self.pip_requirements:
+                        with open(os.path.join(model_dir, "requirements.txt"), "r") as f:
+                            self.pip_requirements[model_class] = [line.strip() for line in f
+                                                                  if line.strip() and not line.startswith("#")]
+                    self.client.log_artifacts(run_id, model_dir, artifact_path)
+                self.client.set_tag(run_id, MLFLOW_LOGGED_MODELS, json.dumps([mlflow_model.to_dict()]))
+        except Exception:
+            self.client.set_terminated(run_id, RunStatus.to_string(RunStatus.FAILED))
+            raise
+        self.client.set_terminated(run_id, RunStatus.to_string(RunStatus.FINISHED))
+        logging.info(f"mlflow run {run_name} written in the background")
+
+    def close(self):
+        """Blocks until every queued run is written; raises if any of them failed."""
+        self.pending_runs.put(None)
+        self.worker.join()
+        if self.errors:
+            raise CustomException(self.errors[0])
@@ -1,7 +1,8 @@
 import os
 import pickle
 import json
-import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
 from src.exception import CustomException
 
 
@@ -51,7 +52,139 @@ def load_json(file_path):
             
     
 
+def save_dataframe(file_path, df):
+    """Writes `df` as csv, parquet or feather, chosen by the file extension."""
+    try:
+        dir_path = os.path.dirname(file_path)
+        os.makedirs(dir_path, exist_ok=True)
+
+        if file_path.endswith(".parquet"):
+            df.to_parquet(file_path, index=False)
+        elif file_path.endswith(".feather"):
+            df.reset_index(drop=True).to_feather(file_path)
+        else:
+            df.to_csv(file_path, index=False)
+
+    except Exception as e:
+        raise CustomException(e)
+
+
+def load_dataframe(file_path):
+    try:
+        if file_path.endswith(".parquet"):
+            return pd.read_parquet(file_path)
+        elif file_path.endswith(".feather"):
+            return pd.read_feather(file_path)
+        else:
+            return pd.read_csv(file_path)
+
+    except Exception as e:
+        raise CustomException(e)
+
+
+def is_categorical(column):
+    """String columns, read from csv (object) or from the typed parquet / feather files (category)."""
+    return column.dtypes == object or isinstance(column.dtypes, pd.CategoricalDtype)
+
+
+def get_array_path(file_path, is_sparse):
+    """Sparse matrices are stored as .npz next to where the dense .npy would go."""
+    return os.path.splitext(file_path)[0] + (".npz" if is_sparse else ".npy")
+
+
+def save_array(file_path, arr):
+    """Saves a dense array with np.save or a scipy sparse matrix with save_npz ; returns the path written."""
+    try:
+        from scipy import sparse
+
+        dir_path = os.path.dirname(file_path)
+        os.makedirs(dir_path, exist_ok=True)
+
+        is_sparse = sparse.issparse(arr)
+        file_path = get_array_path(file_path, is_sparse)
+        if is_sparse:
+            sparse.save_npz(file_path, arr.tocsr())
+        else:
+            np.save(file_path, arr)
+        return file_path
+
+    except Exception as e:
+        raise CustomException(e)
+
+
+def load_array(file_path, mmap_mode=None):
+    """`mmap_mode` memory-maps .npy files ; sparse .npz files are always read into memory."""
+    try:
+        if file_path.endswith(".npz"):
+            from scipy import sparse
+
+            return sparse.load_npz(file_path).tocsr()
+        return np.load(file_path, mmap_mode=mmap_mode)
+
+    except Exception as e:
+        raise CustomException(e)
+
+
+class LazyArray:
+    """Handle to a saved array that is only opened (memory-mapped for .npy) when it is resolved."""
+    def __init__(self, file_path, mmap_mode="r"):
+        self.file_path = file_path
+        self.mmap_mode = mmap_mode
+
+    def load(self):
+        return load_array(self.file_path, mmap_mode=self.mmap_mode)
+
+    def __repr__(self):
+        return f"LazyArray({self.file_path!r}, mmap_mode={self.mmap_mode!r})"
+
+
+def resolve_array(arr):
+    return arr.load() if isinstance(arr, LazyArray) else arr
+
+
+def resolve_n_jobs(n_jobs):
+    """Number of processes for an `n_jobs` setting, with the joblib convention : -1 is every core, -2 all but one."""
+    if n_jobs is None or n_jobs == 0:
+        return 1
+    if n_jobs < 0:
+        return max(os.cpu_count() + 1 + n_jobs, 1)
+    return n_jobs
+
+
+def load_model_metadata(model_path):
+    """Parsed MLmodel file of an MLflow model directory."""
+    try:
+        import yaml
+
+        with open(os.path.join(model_path, "MLmodel"), "r") as f:
+            return yaml.safe_load(f)
+
+    except Exception as e:
+        raise CustomException(e)
+
+
+def load_sklearn_model(model_path):
+    """
+    Loads a model saved with mlflow.sklearn.save_model without importing mlflow : a pickle
+    serialized sklearn flavor is unpickled straight from its model file, any other flavor
+    falls back to mlflow.sklearn.load_model.
+    """
+    try:
+        sklearn_flavor = load_model_metadata(model_path).get("flavors", {}).get("sklearn", {})
+        if sklearn_flavor.get("serialization_format") == "pickle" and not sklearn_flavor.get("code"):
+            return load_object(os.path.join(model_path, sklearn_flavor["pickled_model"]))
+
+        import mlflow.sklearn
+        return mlflow.sklearn.load_model(model_path)
+
+    except Exception as e:
+        raise CustomException(e)
+
+
 def generate_roc_curves(experiment_names, all_fpr, all_tpr, all_auc, plot_file_name):
+    # pyplot is only needed by the training pipeline, importing it up front slows down every import of utils
+    import matplotlib.pyplot as plt
+
     os.makedirs(os.path.dirname(plot_file_name), exist_ok=True)
     plt.figure(figsize=(8, 8))
 